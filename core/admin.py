@@ -1,10 +1,38 @@
 from django.contrib import admin
 
-from core.models import Match, Room, SelectedWord, Word, WordsFile
+from core.models import (Match, Room, SelectedWord, Word, WordBankVersion,
+                         WordsFile)
+
+
+class WordsFileAdmin(admin.ModelAdmin):
+    list_display = [
+        'csv_file',
+        'status',
+        'read_rows',
+        'inserted_words',
+        'updated_words',
+        'retired_words',
+        'created_at',
+        'finished_at',
+    ]
+    list_filter = ['status']
+    readonly_fields = [
+        'status',
+        'read_rows',
+        'inserted_words',
+        'updated_words',
+        'retired_words',
+        'error',
+        'created_at',
+        'updated_at',
+        'finished_at',
+    ]
+
 
 # Register your models here.
 admin.site.register(Word)
 admin.site.register(Match)
 admin.site.register(Room)
 admin.site.register(SelectedWord)
-admin.site.register(WordsFile)
+admin.site.register(WordsFile, WordsFileAdmin)
+admin.site.register(WordBankVersion)
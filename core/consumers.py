@@ -1,9 +1,110 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from core.encoding import JSON, SUBPROTOCOLS, Frame, encode, negotiate
+from core.lobby import LOBBY_GROUP_NAME
+from core.metrics import registry
+from core.models import RoomEvent
+from core.roomcache import get_room_snapshot, get_room_version
+
+logger = logging.getLogger(__name__)
+
+# Close code of websockets whose messages can not be written, e.g. when
+# the database is locked, the client reconnects passing `since`
+INTERNAL_ERROR_CLOSE_CODE = 1011
+
+outbox_coalesced = registry.counter(
+    'room_outbox_coalesced_total',
+    'Times pending deltas of a slow websocket are replaced by a snapshot'
+)
+
+
+@database_sync_to_async
+def get_room_catch_up(
+    room_pk: int,
+    since: Optional[int],
+    known: int = 0
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Return the current sequence number of room and messages which bring a
+    client, who has seen events up to `since`, up to date: the missed
+    events if they are all still in room's ring buffer, otherwise a
+    snapshot. Sequence number is at least `known`, the last one received
+    by caller, even if the cached version is older.
+    """
+    seq = get_room_version(room_pk, known)
+
+    if since is not None and 0 <= since <= seq:
+        events = list(RoomEvent.objects.filter(
+            room_id=room_pk,
+            seq__gt=since,
+            seq__lte=seq,
+        ).order_by('seq').values_list('seq', 'data'))
+        if [event_seq for event_seq, _ in events] == list(
+            range(since + 1, seq + 1)
+        ):
+            return seq, [
+                {'type': 'delta', 'seq': event_seq, 'data': data}
+                for event_seq, data in events
+            ]
+
+    seq, room = get_room_snapshot(room_pk, seq)
+    return seq, [{'type': 'snapshot', 'seq': seq, 'data': room}]
 
 
 class RoomConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Send the whole room as a snapshot once on connect and then only its
+    changes as deltas:
+
+    - `{'type': 'snapshot', 'seq': n, 'data': room}`
+    - `{'type': 'delta', 'seq': n, 'data': changes}`
+
+    Keys of a delta's data replace the same keys of room, except `match`
+    whose keys replace the same keys of room's match, and its `word`
+    which sets `words[word['index']]` of the match. Applying a delta
+    twice is harmless. Deltas which are not newer than the last sent
+    message are dropped, and a delta may cover several events, so
+    sequence numbers may skip.
+
+    A reconnecting client may pass the sequence number of the last message
+    it has seen as `since` query parameter, then only the missed deltas
+    are sent instead of the snapshot, as long as the room still keeps them.
+
+    Messages are JSON text, unless the client asks for one of `SUBPROTOCOLS`,
+    e.g. `gerd.msgpack.v1` for binary MessagePack whose keys are replaced
+    by their index in `INTERNED_KEYS`. Deltas come from the publisher
+    already encoded, once for all websockets of room.
+
+    Deltas wait in an outbox of at most `ROOM_OUTBOX_SIZE` messages while
+    the previous message is being sent, or a catch-up is being loaded,
+    and when it is full they are all replaced by one snapshot of the room
+    taken when it is written. This bounds only what waits in the consumer:
+    daphne takes each message at once and buffers it in the transport
+    without limit, so the outbox fills only when `send` itself waits.
+    When a message can not be written, e.g. a catch-up is not loaded, the
+    websocket is closed with `INTERNAL_ERROR_CLOSE_CODE`.
+    """
+
     def __init__(self, *args, **kwargs):
         self.group_added = False
+        # Sequence number of the last message sent, and queued
+        self.seq = 0
+        self.queued_seq = 0
+        # (seq, frame) of deltas waiting to be sent
+        self.outbox: Deque[Tuple[int, Frame]] = deque()
+        # Whether the outbox is replaced by a snapshot, or by messages which
+        # bring the client up to date from `seq`
+        self.resync: Optional[str] = None
+        self.outbox_ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
         super().__init__(*args, **kwargs)
 
     async def connect(self):
@@ -21,16 +122,43 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
 
         self.room_group_name = 'room_%d' % self.room_pk
 
-        # Join room group
+        # Join room group before taking the snapshot, so no change is missed
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         self.group_added = True
 
-        await self.accept()
+        subprotocol = negotiate(self.scope.get('subprotocols', []))
+        self.encoding = SUBPROTOCOLS.get(subprotocol, JSON)
+        await self.accept(subprotocol)
+
+        self.seq, messages = await get_room_catch_up(
+            self.room_pk, self.get_since())
+        for message in messages:
+            await self.send_message(message)
+        self.queued_seq = self.seq
+        self.writer = asyncio.ensure_future(self.write())
+
+    def get_since(self) -> Optional[int]:
+        query_string = parse_qs(self.scope['query_string'].decode('utf-8'))
+        try:
+            return int(query_string['since'][0])
+        except (KeyError, ValueError):
+            return None
+
+    async def send_message(self, message: Dict[str, Any]) -> None:
+        await self.send_frame(encode(message, self.encoding))
+
+    async def send_frame(self, frame: Frame) -> None:
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
 
     async def disconnect(self, close_code):
+        if self.writer is not None:
+            self.writer.cancel()
         if not self.group_added:
             return
         # Leave room group
@@ -41,6 +169,84 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
 
     # Receive message from room group
     async def room_event(self, event):
+        for delta in event['events']:
+            if delta['seq'] <= self.queued_seq:
+                continue
+
+            if len(self.outbox) >= settings.ROOM_OUTBOX_SIZE:
+                self.outbox.clear()
+                self.resync = 'snapshot'
+                outbox_coalesced.inc()
+            elif delta['first_seq'] > self.queued_seq + 1 and \
+                    self.resync is None:
+                # An earlier event is not received yet, e.g. its transaction
+                # is committed later, take it from room's buffer
+                self.resync = 'catch_up'
+
+            self.queued_seq = delta['seq']
+            if self.resync is None:
+                self.outbox.append(
+                    (delta['seq'], delta['frames'][self.encoding]))
+        self.outbox_ready.set()
+
+    async def write(self) -> None:
+        try:
+            await self.write_outbox()
+        except Exception:
+            # Messages would stop silently otherwise
+            logger.exception('Can not write to websocket of room %d',
+                             self.room_pk)
+            await self.close(INTERNAL_ERROR_CLOSE_CODE)
+
+    async def write_outbox(self) -> None:
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+
+            while self.resync is not None or self.outbox:
+                if self.resync is not None:
+                    since = self.seq if self.resync == 'catch_up' else None
+                    self.resync = None
+                    # Deltas queued meanwhile are sent too, if they are newer
+                    seq, messages = await get_room_catch_up(
+                        self.room_pk, since, self.queued_seq)
+                    if seq > self.seq:
+                        self.seq = seq
+                        for message in messages:
+                            await self.send_message(message)
+                    continue
+
+                seq, frame = self.outbox.popleft()
+                if seq <= self.seq:
+                    continue
+                self.seq = seq
+                await self.send_frame(frame)
+
+
+class LobbyConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Send summaries of rooms changed in each lobby tick, i.e. created,
+    joined, rearranged or whose match state changed, as
+    `{'type': 'rooms', 'data': rooms, 'removed': room ids}`.
+    """
+
+    async def connect(self):
+        await self.channel_layer.group_add(
+            LOBBY_GROUP_NAME,
+            self.channel_name
+        )
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
+            LOBBY_GROUP_NAME,
+            self.channel_name
+        )
+
+    # Receive message from lobby group
+    async def lobby_event(self, event):
         await self.send_json({
-            'data': event['data']
+            'type': 'rooms',
+            'data': event['rooms'],
+            'removed': event['removed'],
         })
@@ -0,0 +1,80 @@
+import json
+from typing import Any, Dict, List, Optional, Union
+
+import msgpack
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+# Websocket subprotocol of each encoding, JSON is used when none is asked
+SUBPROTOCOLS = {
+    'gerd.msgpack.v1': MSGPACK,
+}
+
+# Keys of MessagePack messages are replaced by their index in this list,
+# so appending is the only safe change without a new subprotocol
+INTERNED_KEYS = [
+    'type',
+    'seq',
+    'data',
+    'id',
+    'name',
+    'players',
+    'teams',
+    'match',
+    'words',
+    'word',
+    'index',
+    'text',
+    'state',
+    'round_start_time',
+    'current_turn',
+    'current_round',
+    'total_round_count',
+    'round_duration_seconds',
+    'team_one_score',
+    'team_two_score',
+    'correct_guess_score',
+    'skip_penalty',
+]
+KEY_CODES = {key: code for code, key in enumerate(INTERNED_KEYS)}
+
+Frame = Union[str, bytes]
+
+
+def negotiate(subprotocols: List[str]) -> Optional[str]:
+    """
+    Return the first of client's subprotocols which is known, or `None`
+    for JSON
+    """
+    for subprotocol in subprotocols:
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def intern_keys(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            KEY_CODES.get(key, key): intern_keys(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [intern_keys(item) for item in value]
+    return value
+
+
+def encode(message: Dict[str, Any], encoding: str) -> Frame:
+    if encoding == MSGPACK:
+        return msgpack.packb(intern_keys(message), use_bin_type=True)
+    return json.dumps(message, separators=(',', ':'))
+
+
+def encode_all(message: Dict[str, Any]) -> Dict[str, Frame]:
+    """
+    Encode message once in every encoding, for messages sent to many
+    websockets
+    """
+    return {encoding: encode(message, encoding) for encoding in [
+        JSON, *SUBPROTOCOLS.values()
+    ]}
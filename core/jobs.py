@@ -0,0 +1,103 @@
+import logging
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import WordsFile
+from core.wordimport import merge_words, read_rows, words_changed
+from core.words import publish_word_bank
+
+logger = logging.getLogger(__name__)
+
+
+def claim_words_file() -> Optional[WordsFile]:
+    """
+    Take the oldest pending file, or a running one whose worker has not
+    reported progress for `WORDS_FILE_JOB_TIMEOUT_SECONDS` and is assumed
+    dead. A file is claimed with a conditional update, so concurrent
+    workers never process the same file.
+    """
+    stale = timezone.now() - timedelta(
+        seconds=settings.WORDS_FILE_JOB_TIMEOUT_SECONDS)
+    candidates = WordsFile.objects.filter(
+        Q(status=WordsFile.Status.PENDING) |
+        Q(status=WordsFile.Status.RUNNING, updated_at__lt=stale)
+    ).order_by('id').values_list('id', 'status', 'updated_at')[:10]
+
+    for pk, status, updated_at in candidates:
+        claimed = WordsFile.objects.filter(
+            pk=pk,
+            status=status,
+            updated_at=updated_at,
+        ).update(
+            status=WordsFile.Status.RUNNING,
+            error='',
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            return WordsFile.objects.get(pk=pk)
+    return None
+
+
+def report_progress(words_file: WordsFile, counts: Dict[str, int]) -> None:
+    WordsFile.objects.filter(pk=words_file.pk).update(
+        read_rows=counts['read'],
+        inserted_words=counts['inserted'],
+        updated_words=counts['updated'],
+        retired_words=counts['retired'],
+        updated_at=timezone.now(),
+    )
+
+
+def process_words_file(words_file: WordsFile) -> None:
+    """
+    Merge words of the file into `Word` table and publish them as a new
+    word bank version, in one transaction as `importwords` does, so a file
+    which fails halfway leaves words of the published version as they
+    were. Progress is therefore visible only once the file is merged, and
+    `WORDS_FILE_JOB_TIMEOUT_SECONDS` should be longer than merging a file.
+    """
+    chunk_size = settings.WORDS_FILE_CHUNK_SIZE
+    try:
+        with transaction.atomic():
+            counts = merge_words(
+                read_rows(words_file.csv_file.path, chunk_size),
+                chunk_size,
+                lambda counts: report_progress(words_file, counts)
+            )
+            if words_changed(counts):
+                publish_word_bank()
+    except Exception as e:
+        logger.exception('Can not import words file %d', words_file.pk)
+        WordsFile.objects.filter(pk=words_file.pk).update(
+            status=WordsFile.Status.FAILED,
+            error=str(e),
+            updated_at=timezone.now(),
+            finished_at=timezone.now(),
+        )
+        return
+
+    WordsFile.objects.filter(pk=words_file.pk).update(
+        status=WordsFile.Status.DONE,
+        updated_at=timezone.now(),
+        finished_at=timezone.now(),
+    )
+
+
+def run_words_file_worker(once: bool = False) -> None:
+    while True:
+        words_file = claim_words_file()
+        if words_file is not None:
+            process_words_file(words_file)
+            continue
+
+        if once:
+            return
+
+        close_old_connections()
+        time.sleep(settings.WORDS_FILE_POLL_INTERVAL_SECONDS)
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from copy import deepcopy
+from typing import Dict, List, Optional
+
+from channels_redis.core import RedisChannelLayer
+
+logger = logging.getLogger(__name__)
+
+
+class LocalFirstChannelLayer(RedisChannelLayer):
+    """
+    Redis channel layer which delivers group messages to members in this
+    process directly, and through Redis only to members in other processes.
+
+    Members are still added to groups in Redis, so other processes reach
+    them, and each process keeps its own members of groups too. A group
+    whose members are all local costs reading the group from Redis, and
+    no writes, nor reads by each receiving consumer.
+
+    Local channels wait only on their buffers, which are filled by local
+    group messages and by one task per channel prefix that pops messages
+    sent through Redis to this process, instead of by whichever receiver
+    holds the receive lock as in the base layer, so a local message is
+    not held up by a receiver blocked on Redis.
+
+    As with `InMemoryChannelLayer`, each local member gets a copy of the
+    message, and members are forgotten after `group_expiry`.
+    """
+
+    # Seconds a pump waits after failing to pop from Redis, doubled on
+    # each failure in a row
+    pump_retry_delay = 0.1
+    pump_max_retry_delay = 5.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local_lock = threading.Lock()
+        # group -> local channel -> time added
+        self.local_groups: Dict[str, Dict[str, float]] = defaultdict(dict)
+        # Local channels are received on only one event loop at a time
+        self.local_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.local_receivers = 0
+        # non-local part of channel name -> task popping its messages
+        self.pumps: Dict[str, asyncio.Task] = {}
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+
+    def is_local(self, channel: str) -> bool:
+        return '!' in channel and self.non_local_name(channel).endswith(
+            self.client_prefix + '!')
+
+    async def receive(self, channel):
+        if not self.is_local(channel):
+            return await super().receive(channel)
+
+        loop = asyncio.get_running_loop()
+        if self.local_loop is not loop:
+            if self.local_receivers:
+                raise RuntimeError(
+                    'Two event loops are trying to receive() on one channel '
+                    'layer at once!'
+                )
+            self.stop_pumps()
+            self.local_loop = loop
+
+        self.local_receivers += 1
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        real_channel = self.non_local_name(channel)
+        if real_channel not in self.pumps:
+            self.pumps[real_channel] = loop.create_task(
+                self.pump(real_channel))
+
+        try:
+            buffer = self.receive_buffer[channel]
+            message = await buffer.get()
+            if buffer.empty():
+                self.receive_buffer.pop(channel, None)
+            return message
+        except asyncio.CancelledError:
+            self.receive_buffer.pop(channel, None)
+            raise
+        finally:
+            self.local_receivers -= 1
+            if not self.local_receivers:
+                # Popping from Redis is stopped once nothing receives for a
+                # while, rather than between each message
+                self._idle_handle = loop.call_later(
+                    self.brpop_timeout, self.stop_pumps)
+
+    async def pump(self, real_channel: str) -> None:
+        delay = 0.0
+        while True:
+            try:
+                message_channel, message = await self.receive_single(
+                    real_channel)
+            except Exception:
+                # The pump is kept in `pumps`, so it must outlive errors of
+                # Redis for the channels waiting on it to get messages again
+                delay = min(max(delay * 2, self.pump_retry_delay),
+                            self.pump_max_retry_delay)
+                logger.exception('Can not receive from %s, retrying in %gs',
+                                 real_channel, delay)
+                await asyncio.sleep(delay)
+                continue
+            delay = 0.0
+            if not isinstance(message_channel, list):
+                message_channel = [message_channel]
+            for channel in message_channel:
+                self.receive_buffer[channel].put_nowait(message)
+
+    def stop_pumps(self) -> None:
+        self._idle_handle = None
+        pumps, self.pumps = self.pumps, {}
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for pump in pumps.values():
+            loop = pump.get_loop()
+            if loop is running:
+                pump.cancel()
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(pump.cancel)
+
+    async def group_add(self, group, channel):
+        await super().group_add(group, channel)
+        if self.is_local(channel):
+            with self._local_lock:
+                self.local_groups[group][channel] = time.time()
+
+    async def group_discard(self, group, channel):
+        with self._local_lock:
+            members = self.local_groups.get(group, {})
+            members.pop(channel, None)
+            if not members:
+                self.local_groups.pop(group, None)
+        await super().group_discard(group, channel)
+
+    async def group_send(self, group, message):
+        for channel in self.get_local_members(group):
+            self.deliver(channel, deepcopy(message))
+        await super().group_send(group, message)
+
+    def _map_channel_keys_to_connection(self, channel_names, message):
+        # Called by `group_send` of base layer with all members of group
+        # in Redis, local ones have got the message already
+        return super()._map_channel_keys_to_connection(
+            [channel for channel in channel_names
+             if not self.is_local(channel)],
+            message
+        )
+
+    def get_local_members(self, group: str) -> List[str]:
+        expired_at = time.time() - self.group_expiry
+        with self._local_lock:
+            members = self.local_groups.get(group, {})
+            for channel in [
+                channel for channel, added_at in members.items()
+                if added_at < expired_at
+            ]:
+                del members[channel]
+            return list(members)
+
+    def deliver(self, channel: str, message: dict) -> None:
+        loop = self.local_loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if loop is None or loop is running or loop.is_closed():
+            self.receive_buffer[channel].put_nowait(message)
+        else:
+            # Queues of receive buffer are not thread-safe
+            loop.call_soon_threadsafe(
+                lambda: self.receive_buffer[channel].put_nowait(message))
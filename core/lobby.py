@@ -0,0 +1,85 @@
+import threading
+from datetime import timedelta
+from typing import Set
+
+import channels.layers
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from core.models import Room
+from core.publisher import PublisherLoop, publisher_loop
+from core.scheduler import Scheduler, round_scheduler
+from core.serializers import RoomSummarySerializer
+
+LOBBY_GROUP_NAME = 'lobby'
+
+
+class LobbyPublisher:
+    """
+    Collect rooms changed during a tick of `LOBBY_TICK_SECONDS` and send
+    their summaries to lobby websockets in one message, so a burst of
+    changes costs one push.
+
+    Summaries are fetched in scheduler's thread and sent from publisher
+    loop.
+    """
+
+    def __init__(self, scheduler: Scheduler, loop: PublisherLoop):
+        self.scheduler = scheduler
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._room_ids: Set[int] = set()
+
+    def room_changed(self, room_id: int) -> None:
+        with self._lock:
+            first = not self._room_ids
+            self._room_ids.add(room_id)
+
+        if first:
+            self.scheduler.schedule(
+                timezone.now() + timedelta(
+                    seconds=settings.LOBBY_TICK_SECONDS
+                ),
+                self.flush,
+                key='flush_lobby'
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._room_ids.clear()
+            self.scheduler.cancel('flush_lobby')
+
+    def flush(self) -> None:
+        with self._lock:
+            room_ids, self._room_ids = self._room_ids, set()
+        if not room_ids:
+            return
+
+        try:
+            rooms = RoomSummarySerializer(
+                Room.objects.select_related('match').filter(
+                    pk__in=room_ids
+                ).order_by('id'),
+                many=True
+            ).data
+        finally:
+            close_old_connections()
+
+        # Rooms which are changed and then deleted in the same tick
+        removed = room_ids - {room['id'] for room in rooms}
+
+        channel_layer = channels.layers.get_channel_layer()
+        self.loop.call_later(
+            0,
+            channel_layer.group_send,
+            LOBBY_GROUP_NAME,
+            {
+                'type': 'lobby_event',
+                'rooms': rooms,
+                'removed': sorted(removed),
+            }
+        )
+
+
+lobby_publisher = LobbyPublisher(round_scheduler, publisher_loop)
@@ -0,0 +1,82 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from core.models import Match, Room
+from core.views import get_room_and_check_turn
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measures latency of turn authorization of play, correct and ' \
+        'skip on a throwaway room, nothing is kept in database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='Number of measured calls'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if iterations <= 0:
+            raise CommandError('Iterations should be positive')
+
+        try:
+            with transaction.atomic():
+                self.bench(iterations)
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def bench(self, iterations: int) -> None:
+        room = Room.objects.create(name='benchturn')
+        players = [
+            User.objects.create(username=f'benchturn-{i}') for i in range(4)
+        ]
+        for player in players:
+            room.seat_player(player)
+        Match.objects.create(
+            room=room,
+            state=Match.State.PLAYING,
+            current_turn=0,
+            current_round=1
+        )
+
+        request = APIRequestFactory().post(f'/rooms/{room.pk}/correct')
+        request.user = players[0]
+
+        def check():
+            get_room_and_check_turn(
+                request, room.pk, [Match.State.PLAYING])
+
+        with CaptureQueriesContext(connection) as queries:
+            check()
+
+        for _ in range(min(100, iterations)):
+            check()
+
+        timings = []
+        for _ in range(iterations):
+            started_at = time.perf_counter()
+            check()
+            timings.append(time.perf_counter() - started_at)
+        timings.sort()
+
+        self.stdout.write(
+            f'{len(queries)} queries per call, '
+            f'mean {statistics.mean(timings) * 1e6:.0f}us, '
+            f'p50 {timings[len(timings) // 2] * 1e6:.0f}us, '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f}us '
+            f'over {iterations} calls'
+        )
@@ -1,12 +1,29 @@
-import pandas as pd
+import time
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from tqdm import tqdm
 
-from core.models import Word
+from core.wordimport import (WordImportError, merge_words, read_rows,
+                             replace_words, words_changed)
+from core.words import publish_word_bank
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def get_peak_memory_mib() -> float:
+    if resource is None:  # pragma: no cover
+        return float('nan')
+    # `ru_maxrss` is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
 
 class Command(BaseCommand):
-    help = 'Clears words and imports new words from given CSV file'
+    help = 'Merges words of given CSV file into existing words, ' \
+        'or clears existing words first with `--replace`'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -14,42 +31,62 @@ class Command(BaseCommand):
             type=str,
             help='Path to CSV file to import words from'
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Number of rows to read and write at once'
+        )
+        parser.add_argument(
+            '--replace',
+            action='store_true',
+            help='Delete all existing words, along with matches history, '
+                 'instead of merging'
+        )
 
     def handle(self, *args, **options):
-        try:
-            words_df: pd.DataFrame = pd.read_csv(
-                options['csv_file']
-            )
-        except Exception as e:
-            raise CommandError(f'Can not parse CSV file: {e}')
-
-        if 'complexity' not in words_df.columns:
-            raise CommandError(
-                f'Can not find `complexity` in columns: '
-                f'{words_df.columns.values}'
-            )
-
-        if 'text' not in words_df.columns:
-            raise CommandError(
-                f'Can not find `text` in columns: {words_df.columns.values}')
-
-        Word.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS('Cleared all existing words'))
-        for _, row in tqdm(
-            words_df.iterrows(),
-            total=words_df.shape[0]
-        ):
+        chunk_size = options['chunk_size']
+        if chunk_size <= 0:
+            raise CommandError('Chunk size should be positive')
+
+        import_words = replace_words if options['replace'] else merge_words
+        started_at = time.monotonic()
+        with tqdm(
+            unit='rows',
+            disable=options['verbosity'] == 0
+        ) as progress:
+            def on_chunk(counts):
+                progress.update(counts['read'] - progress.n)
+
             try:
-                Word.objects.create(
-                    text=row['text'],
-                    complexity=row['complexity']
-                )
-            except Exception as e:
-                raise CommandError(
-                    f'Can create new word from given row, '
-                    f'error: {e}\nrow:\n{row}'
-                )
+                with transaction.atomic():
+                    counts = import_words(
+                        read_rows(options['csv_file'], chunk_size),
+                        chunk_size,
+                        on_chunk
+                    )
+            except WordImportError as e:
+                raise CommandError(e)
+        elapsed = time.monotonic() - started_at
+
+        if options['replace']:
+            self.stdout.write(self.style.SUCCESS('Cleared all existing words'))
+        for name, count in counts.items():
+            if name != 'read':
+                self.stdout.write(
+                    self.style.SUCCESS(f'{name.title()} {count} words'))
+
+        self.stdout.write(
+            f'Read {counts["read"]} rows in {elapsed:.2f}s '
+            f'({counts["read"] / max(elapsed, 1e-9):.0f} rows/s), '
+            f'peak memory {get_peak_memory_mib():.1f} MiB'
+        )
+
+        if not options['replace'] and not words_changed(counts):
+            self.stdout.write('Words are not changed')
+            return
 
+        version = publish_word_bank()
         self.stdout.write(
-            self.style.SUCCESS(f'Inserted {words_df.shape[0]} new words')
+            self.style.SUCCESS(f'Published word bank version {version}')
         )
@@ -0,0 +1,129 @@
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import timedelta
+from typing import List, Tuple
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Match, Room
+
+
+class Command(BaseCommand):
+    help = 'Plays `correct` on many rooms concurrently through the ASGI ' \
+        'application in this process and reports throughput and latency, ' \
+        'rooms and players it creates are deleted afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rooms',
+            type=int,
+            default=50,
+            help='Number of rooms played concurrently'
+        )
+        parser.add_argument(
+            '--actions',
+            type=int,
+            default=20,
+            help='Number of `correct` calls per room'
+        )
+        parser.add_argument(
+            '--in-memory-layer',
+            action='store_true',
+            help='Use in-memory channel layer instead of configured one'
+        )
+
+    def handle(self, *args, **options):
+        if options['rooms'] <= 0 or options['actions'] <= 0:
+            raise CommandError('Rooms and actions should be positive')
+
+        overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if options['in_memory_layer']:
+            overrides['CHANNEL_LAYERS'] = {
+                'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+            }
+            overrides['CACHES'] = {
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+                }
+            }
+
+        # Requests are served by other threads, so rows can not be rolled
+        # back as in `benchturn`, only the ones created here are deleted
+        self.room_ids: List[int] = []
+        self.user_ids: List[int] = []
+        try:
+            rooms = self.create_rooms(options['rooms'])
+            with override_settings(**overrides):
+                timings, elapsed = self.play(rooms, options['actions'])
+        finally:
+            Room.objects.filter(pk__in=self.room_ids).delete()
+            User.objects.filter(pk__in=self.user_ids).delete()
+
+        timings.sort()
+        self.stdout.write(
+            f'{len(timings)} requests in {elapsed:.2f}s '
+            f'({len(timings) / elapsed:.0f} requests/s), '
+            f'mean {statistics.mean(timings) * 1e3:.1f}ms, '
+            f'p50 {timings[len(timings) // 2] * 1e3:.1f}ms, '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1e3:.1f}ms'
+        )
+
+    def create_rooms(self, count: int) -> List[Tuple[int, str]]:
+        """
+        Create rooms with playing matches and return them along with token
+        of their explaining players
+        """
+        run = uuid.uuid4().hex[:8]
+        rooms = []
+        for i in range(count):
+            room = Room.objects.create(name='loadtest')
+            self.room_ids.append(room.pk)
+            players = []
+            for j in range(4):
+                players.append(User.objects.create(
+                    username=f'loadtest-{run}-{i}-{j}'))
+                self.user_ids.append(players[-1].pk)
+            for player in players:
+                room.seat_player(player)
+            Match.objects.create(
+                room=room,
+                state=Match.State.PLAYING,
+                current_turn=0,
+                current_round=1,
+                round_deadline=timezone.now() + timedelta(hours=1)
+            )
+            rooms.append((room.pk, players[0].auth_token.key))
+        return rooms
+
+    def play(self, rooms: List[Tuple[int, str]], actions: int):
+        timings: List[float] = []
+        client = AsyncClient()
+
+        async def play_room(room_id: int, token: str):
+            for _ in range(actions):
+                started_at = time.perf_counter()
+                response = await client.post(
+                    reverse('correct', args=[room_id]),
+                    AUTHORIZATION=f'Token {token}',
+                )
+                timings.append(time.perf_counter() - started_at)
+                if response.status_code != 200:
+                    raise CommandError(
+                        f'Unexpected response {response.status_code}: '
+                        f'{response.content[:200]}'
+                    )
+
+        async def play_rooms():
+            await asyncio.gather(*[
+                play_room(room_id, token) for room_id, token in rooms
+            ])
+
+        started_at = time.perf_counter()
+        asyncio.run(play_rooms())
+        return timings, time.perf_counter() - started_at
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.jobs import run_words_file_worker
+
+
+class Command(BaseCommand):
+    help = 'Runs the worker which imports uploaded words files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when there is no pending file instead of polling'
+        )
+
+    def handle(self, *args, **options):
+        run_words_file_worker(once=options['once'])
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.2 on 2026-10-16 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_wordsfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='deck_seed',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='easy_words_drawn',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='hard_words_drawn',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='intermediate_words_drawn',
+            field=models.IntegerField(default=0),
+        ),
+    ]
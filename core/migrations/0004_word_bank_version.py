@@ -0,0 +1,25 @@
+# Generated by Django 4.0.2 on 2026-10-16 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_match_deck'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WordBankVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('published_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='word_bank_version',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
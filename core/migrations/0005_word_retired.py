@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-16 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_word_bank_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='word',
+            name='retired',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.0.2 on 2026-10-16 23:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_existing_files_done(apps, schema_editor):
+    # Files uploaded before the worker existed are already imported
+    WordsFile = apps.get_model('core', 'WordsFile')
+    WordsFile.objects.update(status=3)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_word_retired'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wordsfile',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='wordsfile',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='wordsfile',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='wordsfile',
+            name='inserted_words',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wordsfile',
+            name='read_rows',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wordsfile',
+            name='retired_words',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wordsfile',
+            name='status',
+            field=models.IntegerField(choices=[(1, 'Pending'), (2, 'Running'), (3, 'Done'), (4, 'Failed')], default=1),
+        ),
+        migrations.AddField(
+            model_name='wordsfile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='wordsfile',
+            name='updated_words',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='wordsfile',
+            index=models.Index(fields=['status', 'id'], name='core_wordsf_status_da14b2_idx'),
+        ),
+        migrations.RunPython(
+            mark_existing_files_done,
+            migrations.RunPython.noop,
+        ),
+    ]
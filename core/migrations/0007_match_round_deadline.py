@@ -0,0 +1,36 @@
+# Generated by Django 4.0.2 on 2026-10-16 23:06
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def set_playing_rounds_deadline(apps, schema_editor):
+    Match = apps.get_model('core', 'Match')
+    for match in Match.objects.filter(state=2, round_start_time__isnull=False):
+        match.round_deadline = match.round_start_time + timedelta(
+            seconds=match.round_duration_seconds)
+        match.save(update_fields=['round_deadline'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_wordsfile_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='round_deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['state', 'round_deadline'], name='core_match_state_b64ffe_idx'),
+        ),
+        migrations.RunPython(
+            set_playing_rounds_deadline,
+            migrations.RunPython.noop,
+        ),
+    ]
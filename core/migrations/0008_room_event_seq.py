@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-16 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_match_round_deadline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='event_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.2 on 2026-10-16 23:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_room_event_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.IntegerField()),
+                ('seq', models.BigIntegerField()),
+                ('data', models.JSONField()),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='core.room')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='roomevent',
+            constraint=models.UniqueConstraint(fields=('room', 'slot'), name='unique_room_event_slot'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.2 on 2026-10-16 23:15
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_room_players(apps, schema_editor):
+    Room = apps.get_model('core', 'Room')
+    for room in Room.objects.annotate(count=Count('players')):
+        room.player_count = room.count
+        room.save(update_fields=['player_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_roomevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='player_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['player_count', '-id'], name='core_room_player__c06a91_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['name', '-id'], name='core_room_name_bd8dba_idx'),
+        ),
+        migrations.RunPython(
+            count_room_players,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.0.2 on 2026-10-16 23:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_seats(apps, schema_editor):
+    # Players used to take turns in order of their usernames
+    Seat = apps.get_model('core', 'Seat')
+    room_id = None
+    for seat in Seat.objects.order_by('room_id', 'user__username'):
+        if seat.room_id != room_id:
+            room_id = seat.room_id
+            number = 0
+        seat.seat = number
+        seat.save(update_fields=['seat'])
+        number += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0010_room_player_count'),
+    ]
+
+    operations = [
+        # `Seat` takes over the existing table of `Room.players`
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Seat',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seats', to='core.room')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seats', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'core_room_players',
+                        'ordering': ['seat'],
+                        'unique_together': {('room', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='room',
+                    name='players',
+                    field=models.ManyToManyField(blank=True, through='core.Seat', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='seat',
+            name='seat',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(
+            assign_seats,
+            migrations.RunPython.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='seat',
+            constraint=models.UniqueConstraint(fields=('room', 'seat'), name='unique_room_seat'),
+        ),
+    ]
@@ -1,9 +1,10 @@
-import os
+from typing import List
 
 from django.conf import settings
-from django.core.management import call_command
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
@@ -17,6 +18,8 @@ class Word(models.Model):
         HARD = 3
 
     complexity = models.IntegerField(choices=Complexity.choices)
+    # Retired words are not drawn anymore but are kept for match history
+    retired = models.BooleanField(default=False)
 
     def __str__(self):
         return self.text
@@ -47,6 +50,9 @@ class Match(models.Model):
 
     state = models.IntegerField(choices=State.choices)
     round_start_time = models.DateTimeField(blank=True, null=True)
+    # When the playing round should finish, kept in database so overdue
+    # rounds can be finished even if the process which started them died
+    round_deadline = models.DateTimeField(blank=True, null=True)
     current_turn = models.IntegerField(blank=True, null=True)
     current_round = models.IntegerField(blank=True, null=True)
 
@@ -58,11 +64,46 @@ class Match(models.Model):
     correct_guess_score = models.IntegerField(default=3)
     skip_penalty = models.IntegerField(default=1)
 
+    # Every match draws words from its own shuffled deck, which is fully
+    # determined by the seed, and counts drawn words per complexity.
+    deck_seed = models.BigIntegerField(blank=True, null=True)
+    easy_words_drawn = models.IntegerField(default=0)
+    intermediate_words_drawn = models.IntegerField(default=0)
+    hard_words_drawn = models.IntegerField(default=0)
+    word_bank_version = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'round_deadline']),
+        ]
+
+
+class RoomQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Fetch everything `RoomSerializer` needs in a constant number of
+        queries, however many rooms, players and words there are.
+        """
+        return self.select_related('match').prefetch_related(
+            models.Prefetch(
+                'seats',
+                queryset=Seat.objects.select_related('user').only(
+                    'room', 'seat', 'user__username')
+            ),
+            models.Prefetch(
+                'match__words',
+                queryset=SelectedWord.objects.order_by('id')
+            ),
+        )
+
 
 class Room(models.Model):
+    objects = RoomQuerySet.as_manager()
+
     name = models.CharField(max_length=128)
     players = models.ManyToManyField(
         to=settings.AUTH_USER_MODEL,
+        through='Seat',
         blank=True,
     )
 
@@ -74,12 +115,128 @@ class Room(models.Model):
     teams = models.IntegerField(
         choices=Teams.choices, default=Teams.ONE_TWO__THREE_FOUR)
 
+    # Number of players, kept along `players` so lobby can filter on it
+    player_count = models.IntegerField(default=0)
+
+    # Sequence number of the last event sent to room's websockets
+    event_seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['player_count', '-id']),
+            models.Index(fields=['name', '-id']),
+        ]
+
+    def seat_player(self, user) -> None:
+        """
+        Give the first free seat to user, room should be locked
+        """
+        taken = set(self.seats.values_list('seat', flat=True))
+        seat = min(set(range(len(taken) + 1)) - taken)
+        self.players.add(user, through_defaults={'seat': seat})
+
+    def get_player_usernames(self) -> List[str]:
+        """
+        Usernames of players in order of their seats, i.e. their turns
+        """
+        return [seat.user.username for seat in self.seats.all()]
+
+
+class Seat(models.Model):
+    """
+    Membership of player in room, players take turns in order of seats
+    """
+    room = models.ForeignKey(
+        to=Room,
+        on_delete=models.CASCADE,
+        related_name='seats',
+    )
+    user = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='seats',
+    )
+    seat = models.IntegerField()
+
+    class Meta:
+        # Table of `Room.players` before seats were added
+        db_table = 'core_room_players'
+        ordering = ['seat']
+        unique_together = [['room', 'user']]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['room', 'seat'],
+                name='unique_room_seat'
+            ),
+        ]
+
+
+class RoomEvent(models.Model):
+    """
+    Ring buffer of recent room events, event with sequence number `seq`
+    is kept in slot `seq % ROOM_EVENT_BUFFER_SIZE` until it is overwritten.
+    """
+    room = models.ForeignKey(
+        to=Room,
+        on_delete=models.CASCADE,
+        related_name='events',
+    )
+    slot = models.IntegerField()
+    seq = models.BigIntegerField()
+    data = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['room', 'slot'],
+                name='unique_room_event_slot'
+            ),
+        ]
+
+
+class WordBankVersion(models.Model):
+    """
+    Each row announces a new version of `Word` table to word banks of all
+    running processes.
+    """
+    published_at = models.DateTimeField(auto_now_add=True)
+
 
 class WordsFile(models.Model):
+    """
+    Uploaded words are merged into `Word` table by `processwordsfiles`
+    worker in background, this model is also its job queue.
+    """
     csv_file = models.FileField(
         upload_to='wordsfiles'
     )
 
+    class Status(models.IntegerChoices):
+        PENDING = 1
+        RUNNING = 2
+        DONE = 3
+        FAILED = 4
+
+    status = models.IntegerField(
+        choices=Status.choices, default=Status.PENDING)
+    read_rows = models.IntegerField(default=0)
+    inserted_words = models.IntegerField(default=0)
+    updated_words = models.IntegerField(default=0)
+    retired_words = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return self.csv_file.name
+
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
@@ -87,10 +244,44 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
-@receiver(post_save, sender=WordsFile)
-def import_words_from_file(sender, instance=None, created=False, **kwargs):
-    if created:
-        call_command(
-            'importwords',
-            os.path.join(settings.MEDIA_ROOT, instance.csv_file.path)
+def update_player_counts(room_ids) -> None:
+    Room.objects.filter(pk__in=room_ids).update(
+        player_count=Coalesce(
+            Subquery(
+                Room.players.through.objects.filter(
+                    room_id=OuterRef('pk')
+                ).values('room_id').annotate(
+                    count=Count('*')
+                ).values('count')
+            ),
+            0
         )
+    )
+
+
+@receiver(post_save, sender=Seat)
+@receiver(post_delete, sender=Seat)
+def count_seat_players(sender, instance, **kwargs):
+    # Deleted seats include the ones removed by cascade, e.g. of a deleted
+    # user, which `m2m_changed` is not sent for
+    update_player_counts([instance.room_id])
+
+
+@receiver(m2m_changed, sender=Room.players.through)
+def count_room_players(
+    sender,
+    instance,
+    action,
+    reverse,
+    pk_set=None,
+    **kwargs
+):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+
+    # Seats added through `players` are bulk created without `post_save`,
+    # removed ones are counted by `count_seat_players`
+    if action == 'post_add':
+        update_player_counts([instance.pk] if not reverse else pk_set)
+    if not reverse:
+        instance.refresh_from_db(fields=['player_count'])
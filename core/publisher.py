@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import threading
+from copy import deepcopy
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import channels.layers
+from django.conf import settings
+
+from core.encoding import encode_all
+
+logger = logging.getLogger(__name__)
+
+
+def merge_deltas(
+    delta: Dict[str, Any],
+    later: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Return one delta which has the same effect as applying `delta` and
+    then `later`, or `None` if they both set a different word of match,
+    as a delta sets only one.
+    """
+    merged = deepcopy(delta)
+    for key, value in later.items():
+        if key != 'match' or 'match' not in merged:
+            merged[key] = deepcopy(value)
+            continue
+
+        match = merged['match']
+        for match_key, match_value in value.items():
+            if match_key != 'word':
+                match[match_key] = deepcopy(match_value)
+            elif 'words' in match:
+                # The whole match is sent, put the word in its words
+                index = match_value['index']
+                match['words'].extend(
+                    [None] * (index + 1 - len(match['words'])))
+                match['words'][index] = {'text': match_value['text']}
+            elif 'word' in match and \
+                    match['word']['index'] != match_value['index']:
+                return None
+            else:
+                match['word'] = deepcopy(match_value)
+    return merged
+
+
+def coalesce_events(
+    events: List[Tuple[int, Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """
+    Merge consecutive `(seq, data)` events of a room into as few deltas as
+    possible, each of them covers events from its `first_seq` to its `seq`.
+    """
+    deltas: List[Dict[str, Any]] = []
+    for seq, data in sorted(events, key=lambda event: event[0]):
+        if deltas:
+            merged = merge_deltas(deltas[-1]['data'], data)
+            if merged is not None:
+                deltas[-1]['seq'] = seq
+                deltas[-1]['data'] = merged
+                continue
+        deltas.append({'first_seq': seq, 'seq': seq, 'data': data})
+    return deltas
+
+
+def encode_delta(delta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replace data of a coalesced delta with its message encoded once in
+    every encoding, to be sent as is to all websockets of room.
+    """
+    return {
+        'first_seq': delta['first_seq'],
+        'seq': delta['seq'],
+        'frames': encode_all({
+            'type': 'delta',
+            'seq': delta['seq'],
+            'data': delta['data'],
+        }),
+    }
+
+
+class PublisherLoop:
+    """
+    Event loop kept running in one dedicated thread, on which broadcasts
+    are sent.
+
+    `async_to_sync` runs a new event loop for each call from a thread which
+    has none, and channel layers keep their connections per event loop, so
+    each broadcast would open its own. Sends of a long-lived loop share
+    connections, run concurrently, and do not hold up scheduler's calls,
+    e.g. round deadlines.
+    """
+
+    def __init__(self, name: str = 'publisher'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # running calls, tasks are only weakly referenced by event loop
+        self._tasks: Set[asyncio.Task] = set()
+
+    def call_later(
+        self,
+        delay: float,
+        func: Callable[..., Awaitable],
+        *args
+    ) -> None:
+        """
+        Run coroutine function with args on the loop after delay seconds,
+        can be called from any thread.
+        """
+        loop = self._start()
+        loop.call_soon_threadsafe(
+            loop.call_later, delay, self._run, func, args)
+
+    def _run(self, func: Callable[..., Awaitable], args: Tuple) -> None:
+        task = self._loop.create_task(self._call(func, args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _call(self, func: Callable[..., Awaitable], args: Tuple) -> None:
+        try:
+            await func(*args)
+        except Exception:
+            logger.exception('Published call %r failed', func)
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name=self.name,
+                    daemon=True
+                ).start()
+            return self._loop
+
+
+class RoomPublisher:
+    """
+    Send room events to room websockets from publisher loop, so requests
+    do not wait for the fan-out. Events are queued by `send_room_delta`
+    once their transaction is committed, and events of a room queued
+    within `ROOM_PUBLISH_DELAY_SECONDS` are merged into one broadcast.
+    """
+
+    def __init__(self, loop: PublisherLoop):
+        self.loop = loop
+        self._lock = threading.Lock()
+        # room id -> (seq, data) events waiting to be sent
+        self._events: Dict[int, List[Tuple[int, Dict[str, Any]]]] = {}
+
+    def room_changed(self, room_id: int, seq: int, data: Dict[str, Any]):
+        with self._lock:
+            events = self._events.setdefault(room_id, [])
+            first = not events
+            events.append((seq, data))
+
+        if first:
+            self.loop.call_later(
+                settings.ROOM_PUBLISH_DELAY_SECONDS,
+                self.flush,
+                room_id
+            )
+
+    def clear(self) -> None:
+        """
+        Drop waiting events, flushes which are already due find nothing
+        """
+        with self._lock:
+            self._events.clear()
+
+    async def flush(self, room_id: int) -> None:
+        with self._lock:
+            events = self._events.pop(room_id, [])
+        if not events:
+            return
+
+        channel_layer = channels.layers.get_channel_layer()
+        await channel_layer.group_send(
+            f'room_{room_id}',
+            {
+                'type': 'room_event',
+                'events': [
+                    encode_delta(delta) for delta in coalesce_events(events)
+                ],
+            }
+        )
+
+
+publisher_loop = PublisherLoop()
+room_publisher = RoomPublisher(publisher_loop)
@@ -0,0 +1,69 @@
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import Room
+from core.serializers import RoomSerializer
+
+
+def get_version_key(room_pk: int) -> str:
+    return f'room:{room_pk}:version'
+
+
+def get_snapshot_key(room_pk: int, version: int) -> str:
+    return f'room:{room_pk}:snapshot:{version}'
+
+
+def invalidate_room_version(room_pk: int) -> None:
+    """
+    Forget cached version of room once its change is committed, so it is
+    reloaded by the next reader. Versions are never written by changes, as
+    their commit callbacks may run out of order.
+    """
+    cache.delete(get_version_key(room_pk))
+
+
+def get_room_version(room_pk: int, known: int = 0) -> int:
+    """
+    Return the version of room, which is its last event's sequence number,
+    from cache if it is there and not older than a `known` version.
+
+    A version loaded while a change is being committed may be older than
+    it, so loaded versions are kept for `ROOM_VERSION_CACHE_SECONDS` only.
+    """
+    version = cache.get(get_version_key(room_pk))
+    if version is None or version < known:
+        version = Room.objects.values_list(
+            'event_seq', flat=True).get(pk=room_pk)
+        cache.set(
+            get_version_key(room_pk),
+            version,
+            settings.ROOM_VERSION_CACHE_SECONDS
+        )
+    return version
+
+
+def get_room_snapshot(
+    room_pk: int,
+    version: Optional[int] = None
+) -> Tuple[int, Dict[str, Any]]:
+    """
+    Return the version and serialized room, snapshots are cached per
+    version so they are serialized once however many clients fetch them.
+    """
+    if version is not None:
+        data = cache.get(get_snapshot_key(room_pk, version))
+        if data is not None:
+            return version, data
+
+    # Version is read before the room, so a change which is not counted yet
+    # may be in snapshot too, its delta is applied again then.
+    version = Room.objects.values_list('event_seq', flat=True).get(pk=room_pk)
+    data = RoomSerializer(Room.objects.with_details().get(pk=room_pk)).data
+    cache.set(
+        get_snapshot_key(room_pk, version),
+        data,
+        settings.ROOM_SNAPSHOT_CACHE_SECONDS
+    )
+    return version, data
@@ -4,4 +4,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'rooms/(?P<room_pk>\w+)', consumers.RoomConsumer.as_asgi()),
+    re_path(r'lobby$', consumers.LobbyConsumer.as_asgi()),
 ]
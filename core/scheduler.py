@@ -0,0 +1,122 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from django.utils import timezone
+
+from core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Run callbacks at their deadlines from one dedicated thread.
+
+    Pending calls live in a heap, so scheduling and firing cost O(log n)
+    and the process keeps a single thread however many calls are waiting.
+    A call may have a key, scheduling another call with the same key
+    replaces it.
+
+    Deadlines are converted to monotonic clock when scheduled, so wall
+    clock adjustments do not move them, and how late each call is fired
+    is recorded in `<name>_lateness_seconds` histogram.
+    """
+
+    def __init__(self, name: str = 'scheduler'):
+        self.name = name
+        self.lateness = registry.histogram(
+            f'{name}_lateness_seconds',
+            'How late scheduled calls are fired after their deadlines'
+        )
+        self._condition = threading.Condition()
+        # (monotonic time, sequence) pairs, stale ones are skipped when popped
+        self._heap: List[Tuple[float, int]] = []
+        # sequence -> (callback, args, key)
+        self._calls: Dict[int, Tuple[Callable, Tuple[Any, ...], Hashable]] = {}
+        self._keys: Dict[Hashable, int] = {}
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def schedule(
+        self,
+        deadline: datetime,
+        callback: Callable,
+        *args,
+        key: Optional[Hashable] = None
+    ) -> None:
+        with self._condition:
+            if key is not None:
+                self._cancel(key)
+
+            sequence = next(self._sequence)
+            self._calls[sequence] = (callback, args, key)
+            if key is not None:
+                self._keys[key] = sequence
+            heapq.heappush(self._heap, (
+                time.monotonic() + (deadline - timezone.now()).total_seconds(),
+                sequence
+            ))
+
+            self._start()
+            self._condition.notify()
+
+    def cancel(self, key: Hashable) -> None:
+        with self._condition:
+            self._cancel(key)
+
+    def _cancel(self, key: Hashable) -> None:
+        sequence = self._keys.pop(key, None)
+        if sequence is not None:
+            del self._calls[sequence]
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run,
+            name=self.name,
+            daemon=True
+        )
+        self._thread.start()
+
+    def _next_call(self) -> Tuple[Callable, Tuple[Any, ...], float]:
+        with self._condition:
+            while True:
+                while self._heap and self._heap[0][1] not in self._calls:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                due, sequence = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+                callback, args, key = self._calls.pop(sequence)
+                if key is not None:
+                    del self._keys[key]
+                return callback, args, due
+
+    def _run(self) -> None:
+        while True:
+            callback, args, due = self._next_call()
+            self.lateness.observe(max(time.monotonic() - due, 0))
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception('Scheduled call %r failed', callback)
+
+
+round_scheduler = Scheduler(name='round_scheduler')
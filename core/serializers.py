@@ -1,19 +1,42 @@
+from typing import Any, Dict, List
+
 from django.contrib.auth.models import User
+from django.db.models import Manager
 from rest_framework import serializers
 
 from core.models import Match, Room, SelectedWord
+from core.words import get_word_text, get_word_texts
+
+
+class WordTextField(serializers.ReadOnlyField):
+    """
+    Represent a word by its text, looked up from word bank instead of
+    fetching `Word` row of each selected word.
+    """
+
+    def to_representation(self, value):
+        return get_word_text(value)
+
+
+class SelectedWordListSerializer(serializers.ListSerializer):
+    """
+    Look up texts of all words at once, so words missing from word banks
+    are fetched in one query instead of one query per word.
+    """
+
+    def to_representation(self, data):
+        words = data.all() if isinstance(data, Manager) else data
+        texts = get_word_texts([word.text_id for word in words])
+        return [{'text': texts[word.text_id]} for word in words]
 
 
 class SelectedWordSerializer(serializers.ModelSerializer):
-    text = serializers.SlugRelatedField(
-        many=False,
-        read_only=True,
-        slug_field='text'
-    )
+    text = WordTextField(source='text_id')
 
     class Meta:
         model = SelectedWord
         fields = ['text']
+        list_serializer_class = SelectedWordListSerializer
 
 
 class MatchSerializer(serializers.ModelSerializer):
@@ -39,14 +62,57 @@ class MatchSerializer(serializers.ModelSerializer):
         ]
 
 
+def serialize_match_fields(match: Match, names: List[str]) -> Dict[str, Any]:
+    """
+    Serialize only given fields of match, the same as `MatchSerializer`
+    does, to be sent in room deltas.
+    """
+    fields = MatchSerializer().fields
+    data = dict()
+    for name in names:
+        value = getattr(match, name)
+        data[name] = None if value is None \
+            else fields[name].to_representation(value)
+    return data
+
+
 class RoomSerializer(serializers.ModelSerializer):
     players = serializers.SlugRelatedField(
         many=True,
         queryset=User.objects.all(),
         slug_field='username',
+        write_only=True,
     )
     match = MatchSerializer(many=False, read_only=True)
 
     class Meta:
         model = Room
         fields = ['id', 'name', 'players', 'teams', 'match']
+
+    def create(self, validated_data):
+        players = validated_data.pop('players', [])
+        room = super().create(validated_data)
+        for player in players:
+            room.seat_player(player)
+        return room
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['players'] = instance.get_player_usernames()
+        return data
+
+
+class RoomSummarySerializer(serializers.ModelSerializer):
+    """
+    Lightweight representation of room for lobby, without players and
+    match history.
+    """
+    state = serializers.IntegerField(
+        source='match.state',
+        default=None,
+        read_only=True
+    )
+
+    class Meta:
+        model = Room
+        fields = ['id', 'name', 'teams', 'player_count', 'state']
@@ -1,35 +1,98 @@
 import asyncio
+import io
 import json
 import random
+import tempfile
+import threading
 import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from copy import deepcopy
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple
 from unittest import mock
 
 import jwt
+import msgpack
+import numpy as np
 from asgiref.sync import async_to_sync, sync_to_async
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from channels.routing import URLRouter
 from channels.testing import WebsocketCommunicator
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import override_settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.http import Http404
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase, APITransactionTestCase
-
-from core.models import Match, Room, SelectedWord, Word
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.test import (APIRequestFactory, APITestCase,
+                                 APITransactionTestCase)
+
+from core.consumers import (INTERNAL_ERROR_CLOSE_CODE, RoomConsumer,
+                            outbox_coalesced)
+from core.encoding import KEY_CODES, encode_all, negotiate
+from core.jobs import claim_words_file, run_words_file_worker
+from core.layers import LocalFirstChannelLayer
+from core.lobby import lobby_publisher
+from core.metrics import Histogram, Registry
+from core.models import (Match, Room, RoomEvent, Seat, SelectedWord, Word,
+                         WordBankVersion, WordsFile)
+from core.publisher import (PublisherLoop, coalesce_events, encode_delta,
+                            merge_deltas, room_publisher)
+from core.roomcache import get_version_key
 from core.routing import websocket_urlpatterns
-from core.ticket_auth import TicketAuthMiddlewareStack
-from core.views import get_words_all_indices
+from core.scheduler import Scheduler
+from core.ticket_auth import (RETRY_LATER_CLOSE_CODE, TicketAuthMiddleware,
+                              TicketAuthMiddlewareStack, admission,
+                              memberships)
+from core.views import (Lobby, LogicError, finish_round, get_prefix_end,
+                        get_room_and_check_turn, get_score_increment,
+                        sweep_overdue_rounds, update_match)
+from core.wordimport import KeySet
+from core.words import (WordBank, WordBankRegistry, draw_word, get_word_bank,
+                        publish_word_bank, shuffled_position, word_banks)
 
 
 def get_equipped_test_case(base=APITestCase):
     class EquippedTestCase(base):
         def setUp(self):
-            get_words_all_indices.cache_clear()
+            word_banks.clear()
+            lobby_publisher.clear()
+            room_publisher.clear()
+            memberships.clear()
+            cache.clear()
+
+            # Word banks are loaded at once, so tests do not race with it
+            patcher = mock.patch.object(
+                word_banks, 'load_in_background', word_banks.load)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+            if issubclass(base, TestCase):
+                # Test's transaction is never committed, so run callbacks
+                # at once, but not the publishers which run in other
+                # threads and can not see data of the transaction
+                for patcher in [
+                    mock.patch(
+                        'core.views.transaction.on_commit',
+                        lambda func: func()
+                    ),
+
+                    mock.patch('core.views.lobby_publisher'),
+                    mock.patch('core.views.room_publisher'),
+                ]:
+                    patcher.start()
+                    self.addCleanup(patcher.stop)
 
             self.users: Dict[str, User] = dict()
 
@@ -112,8 +175,7 @@ def get_equipped_test_case(base=APITestCase):
         def get_explaining_player(self, room_id: int = 1):
             response = self.get_room(room_id)
 
-            players = deepcopy(response.data['players'])
-            players.sort()
+            players = response.data['players']
 
             return players[response.data['match']['current_turn']]
 
@@ -220,6 +282,245 @@ class RoomCreateTestCase(get_equipped_test_case()):
         self.assertEqual('does_not_exist', response.data['players'][0].code)
 
 
+class RoomQueryBudgetTestCase(get_equipped_test_case()):
+    words_per_match = 200
+
+    def setUp(self):
+        super().setUp()
+        for i in range(4):
+            self.create_user(username=f'user{i}')
+
+        Word.objects.bulk_create([
+            Word(text=f'word{i}', complexity=Word.Complexity.EASY)
+            for i in range(self.words_per_match)
+        ])
+        word_ids = list(Word.objects.values_list('id', flat=True))
+
+        for room_id in range(1, 4):
+            self.create_sample_room(name=f'Room{room_id}', creator='user0')
+            for i in range(4):
+                self.join_room(f'user{i}', room_id=room_id)
+            self.start_match('user0', room_id=room_id)
+            SelectedWord.objects.bulk_create([
+                SelectedWord(text_id=word_id, match_id=room_id)
+                for word_id in word_ids
+            ])
+
+        # Warm word bank, as it is while matches are being played
+        get_word_bank()
+
+    def test_room_detail_query_budget(self):
+        cache.clear()
+
+        # version, and then room with its match, players and words
+        with self.assertNumQueries(5):
+            response = self.get_room()
+
+        words = response.data['match']['words']
+        self.assertEqual(self.words_per_match, len(words))
+        self.assertEqual({'text': 'word0'}, words[0])
+        self.assertEqual(4, len(response.data['players']))
+
+        # the snapshot of the same version is cached
+        with self.assertNumQueries(0):
+            self.assertEqual(response.data, self.get_room().data)
+
+    def test_room_list_query_budget(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('rooms'))
+
+        self.assertEqual(3, len(response.data))
+        for room in response.data:
+            self.assertEqual(
+                self.words_per_match, len(room['match']['words']))
+
+    def test_words_missing_from_word_bank_are_fetched_at_once(self):
+        word_banks.clear()
+        cache.clear()
+
+        with self.assertNumQueries(6):
+            response = self.get_room()
+
+        self.assertEqual(
+            self.words_per_match, len(response.data['match']['words']))
+
+
+class RoomDetailCacheTestCase(get_equipped_test_case()):
+    def setUp(self):
+        super().setUp()
+        for i in range(4):
+            self.create_user(username=f'user{i}')
+
+        self.create_sample_room(creator='user0')
+        self.join_room('user0')
+
+    def test_unchanged_room_is_not_modified(self):
+        response = self.get_room()
+        self.assertEqual('"1"', response['ETag'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse('room-detail', args=[1]),
+                HTTP_IF_NONE_MATCH='"1"',
+            )
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        self.assertEqual('"1"', response['ETag'])
+
+    def test_every_change_is_a_new_version(self):
+        self.get_room()
+
+        self.join_room('user1')
+        response = self.client.get(
+            reverse('room-detail', args=[1]),
+            HTTP_IF_NONE_MATCH='"1"',
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('"2"', response['ETag'])
+        self.assertIn('user1', response.data['players'])
+
+        for username in ['user2', 'user3']:
+            self.join_room(username)
+        self.start_match('user0')
+        response = self.get_room()
+        self.assertEqual('"5"', response['ETag'])
+        self.assertEqual(Match.State.NEWBORN, response.data['match']['state'])
+
+    def test_version_is_current_when_commits_are_published_out_of_order(
+        self
+    ):
+        self.get_room()
+
+        callbacks = []
+        with mock.patch('core.views.transaction.on_commit', callbacks.append):
+            self.join_room('user1')
+            self.join_room('user2')
+        for callback in reversed(callbacks):
+            callback()
+
+        response = self.client.get(
+            reverse('room-detail', args=[1]),
+            HTTP_IF_NONE_MATCH='"2"',
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('"3"', response['ETag'])
+
+    def test_missing_room_is_not_found(self):
+        response = self.client.get(reverse('room-detail', args=[2]))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class LobbyTestCase(get_equipped_test_case()):
+    def setUp(self):
+        super().setUp()
+        for i in range(4):
+            self.create_user(username=f'user{i}')
+        self.create_words(self.words)
+
+        # Room1 is full and started, Room2 is full, others have open seats
+        for room_id, name in enumerate(
+            ['Room1', 'Room2', 'Lounge3', 'Lounge4', 'Room5'], start=1
+        ):
+            self.create_sample_room(name=name, creator='user0')
+            players = 4 if room_id <= 2 else room_id % 3 + 1
+            for i in range(players):
+                self.join_room(f'user{i}', room_id=room_id)
+        self.start_match('user0', room_id=1)
+
+    def get_lobby(self, **params):
+        response = self.client.get(reverse('lobby'), params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response
+
+    def test_lobby_is_cursor_paginated(self):
+        response = self.get_lobby(page_size=2)
+        self.assertEqual(
+            [5, 4],
+            [room['id'] for room in response.data['results']]
+        )
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [3, 2],
+            [room['id'] for room in response.data['results']]
+        )
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [1],
+            [room['id'] for room in response.data['results']]
+        )
+        self.assertIsNone(response.data['next'])
+
+    def test_rooms_are_summarized(self):
+        room = self.get_lobby().data['results'][-1]
+        self.assertEqual({
+            'id': 1,
+            'name': 'Room1',
+            'teams': Room.Teams.ONE_TWO__THREE_FOUR,
+            'player_count': 4,
+            'state': Match.State.NEWBORN,
+        }, room)
+        self.assertIsNone(self.get_lobby().data['results'][0]['state'])
+
+    def test_lobby_is_filtered(self):
+        def ids(**params):
+            return [
+                room['id'] for room in self.get_lobby(**params).data['results']
+            ]
+
+        self.assertEqual([5, 4, 3], ids(open_seats='true'))
+        self.assertEqual([5, 4, 3, 2], ids(not_started='true'))
+        self.assertEqual([4, 3], ids(name_prefix='Lounge'))
+        self.assertEqual([], ids(name_prefix='lounge'))
+        self.assertEqual([5], ids(open_seats='1', name_prefix='Room'))
+
+    def test_name_prefix_is_looked_up_in_index(self):
+        view = Lobby()
+        view.request = view.initialize_request(
+            APIRequestFactory().get(reverse('lobby'), {'name_prefix': 'Lo'}))
+
+        self.assertIn(
+            'USING INDEX core_room_name',
+            view.get_queryset().order_by('-id').explain()
+        )
+
+    def test_prefix_end(self):
+        self.assertEqual('Lp', get_prefix_end('Lo'))
+        self.assertEqual('Lp', get_prefix_end('Lo' + chr(0x10FFFF)))
+        self.assertIsNone(get_prefix_end(chr(0x10FFFF)))
+
+    def test_lobby_query_budget(self):
+        for i in range(20):
+            Room.objects.create(name=f'Extra{i}')
+
+        with self.assertNumQueries(1):
+            response = self.get_lobby(page_size=10)
+        self.assertEqual(10, len(response.data['results']))
+
+    def test_player_count_follows_players(self):
+        room = Room.objects.get(pk=3)
+        self.assertEqual(room.players.count(), room.player_count)
+
+        room.players.remove(self.users['user0'])
+        self.assertEqual(room.players.count(), room.player_count)
+
+        self.users['user1'].room_set.clear()
+        for room in Room.objects.all():
+            self.assertEqual(room.players.count(), room.player_count)
+
+    def test_player_count_follows_deleted_players(self):
+        self.users['user2'].delete()
+
+        for room in Room.objects.all():
+            self.assertEqual(room.players.count(), room.player_count)
+        # Full rooms have a free seat now
+        self.assertEqual(
+            [5, 4, 3, 2, 1],
+            [room['id'] for room in self.get_lobby(
+                open_seats='true').data['results']]
+        )
+
+
 class JoinRoomTestCase(get_equipped_test_case()):
 
     def setUp(self):
@@ -283,6 +584,39 @@ class JoinRoomTestCase(get_equipped_test_case()):
 
         self.assertEqual(4, Room.objects.get(pk=1).players.count())
 
+    def test_players_are_seated_in_order_of_joining(self):
+        for username in ['user3', 'user1', 'user4', 'user2']:
+            self.join_room(username)
+
+        self.assertEqual(
+            ['user3', 'user1', 'user4', 'user2'],
+            self.get_room().data['players']
+        )
+        self.assertEqual(
+            [0, 1, 2, 3],
+            list(Seat.objects.filter(room_id=1).values_list('seat', flat=True))
+        )
+
+        self.user3.username = 'user9'
+        self.user3.save()
+        self.start_match('user1')
+        self.assertEqual('user9', self.get_explaining_player())
+
+    def test_room_creator_can_seat_players(self):
+        response = self.client.post(
+            reverse('rooms'),
+            data={
+                'name': 'Room2',
+                'players': ['user2', 'user1'],
+            },
+            HTTP_AUTHORIZATION=f'Token {self.user1.auth_token}',
+            format='json'
+        )
+
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(['user2', 'user1'], response.data['players'])
+        self.assertEqual(2, Room.objects.get(pk=2).player_count)
+
 
 class RearrangeTestCase(get_equipped_test_case()):
 
@@ -312,6 +646,30 @@ class RearrangeTestCase(get_equipped_test_case()):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(Room.objects.get(pk=1).teams, new_teams)
 
+    def test_rearrange_does_not_overwrite_concurrent_events(self):
+        for username in ['user1', 'user2', 'user3', 'user4']:
+            self.join_room(username)
+        # An event is recorded by someone else after room is read
+        room = Room.objects.get(pk=1)
+        Room.objects.filter(pk=1).update(event_seq=F('event_seq') + 1)
+
+        with mock.patch('core.views.get_object_or_404', return_value=room):
+            response = self.client.post(
+                reverse('rearrange', args=[1]),
+                data={'teams': Room.Teams.ONE_THREE__TWO_FOUR},
+                format='json',
+                HTTP_AUTHORIZATION=f'Token {self.users["user1"].auth_token}',
+            )
+
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        room = Room.objects.get(pk=1)
+        self.assertEqual(Room.Teams.ONE_THREE__TWO_FOUR, room.teams)
+        self.assertEqual(6, room.event_seq)
+        self.assertEqual(
+            {'teams': Room.Teams.ONE_THREE__TWO_FOUR},
+            RoomEvent.objects.get(room=room, seq=6).data
+        )
+
     def test_joined_player_can_not_rearrange_with_invalid_input(self):
         self.join_room('user1')
         self.join_room('user2')
@@ -424,6 +782,7 @@ class GetTicketTestCase(get_equipped_test_case()):
             algorithms='HS256'
         )
         self.assertEqual(ticket['room'], 1)
+        self.assertEqual(ticket['uid'], self.users['user1'].pk)
         self.assertEqual(ticket['username'], 'user1')
 
         now = datetime.now(tz=timezone.utc)
@@ -446,6 +805,69 @@ class GetTicketTestCase(get_equipped_test_case()):
 
         self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
 
+    def get_ticket(self, username):
+        response = self.client.get(
+            reverse('get_ticket', args=[1]),
+            HTTP_AUTHORIZATION=f'Token {self.users[username].auth_token}',
+        )
+        return response.data['ticket']
+
+    def authenticate(self, ticket, cookie=b''):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        async_to_sync(TicketAuthMiddlewareStack(app))({
+            'type': 'websocket',
+            'query_string': f'ticket={ticket}'.encode(),
+            'headers': [(b'cookie', cookie)],
+        }, None, None)
+        return scopes[0]
+
+    def test_known_players_are_authenticated_without_queries(self):
+        self.join_room('user1')
+        self.join_room('user2')
+
+        scope = self.authenticate(self.get_ticket('user1'))
+        self.assertEqual(1, scope['room_pk'])
+        self.assertEqual(self.users['user1'].pk, scope['user'].pk)
+        self.assertEqual('user1', scope['user'].username)
+
+        # Browsers send session cookie of the site along with handshakes
+        self.client.force_login(self.users['user2'])
+        cookie = f'sessionid={self.client.cookies["sessionid"].value}'
+        ticket = self.get_ticket('user2')
+        with self.assertNumQueries(0):
+            scope = self.authenticate(ticket, cookie.encode())
+        self.assertTrue(scope['user'].is_authenticated)
+        self.assertEqual(self.users['user2'].pk, scope['user'].pk)
+
+    def test_joined_player_is_authenticated(self):
+        self.join_room('user1')
+        self.authenticate(self.get_ticket('user1'))
+
+        self.join_room('user2')
+        self.assertIsNone(memberships.get(1))
+        scope = self.authenticate(self.get_ticket('user2'))
+        self.assertTrue(scope['user'].is_authenticated)
+
+    def test_not_joined_player_is_not_authenticated(self):
+        self.join_room('user1')
+        ticket = jwt.encode(
+            payload={
+                'room': 1,
+                'uid': self.users['user2'].pk,
+                'username': 'user2',
+            },
+            key=settings.TICKET_SECRET,
+            algorithm='HS256'
+        )
+        self.assertFalse(self.authenticate(ticket)['user'].is_authenticated)
+
+    def test_handshake_without_ticket_is_anonymous(self):
+        self.assertFalse(self.authenticate('')['user'].is_authenticated)
+
 
 class StartMatchTestCase(get_equipped_test_case()):
 
@@ -708,8 +1130,7 @@ class PlayMatchTestCase(get_equipped_test_case()):
         self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
 
 
-class RoundTestCase(get_equipped_test_case(APITransactionTestCase)):
-    reset_sequences = True
+class TurnCheckTestCase(get_equipped_test_case()):
 
     def setUp(self):
         super().setUp()
@@ -717,155 +1138,1266 @@ class RoundTestCase(get_equipped_test_case(APITransactionTestCase)):
             self.create_user(username=f'user{i}')
 
         self.create_sample_room(creator='user1')
-        room = Room.objects.get(pk=1)
-        room.teams = Room.Teams.ONE_THREE__TWO_FOUR
-        room.save()
-
-        self.join_room('user1')
-        self.join_room('user2')
-        self.join_room('user3')
-        self.join_room('user4')
+        for i in range(1, 5):
+            self.join_room(f'user{i}')
 
-        self.create_words(self.words)
+    def check_turn(self, username: str, room_id: int = 1):
+        request = APIRequestFactory().post('/')
+        request.user = self.users[username]
+        return get_room_and_check_turn(
+            request, room_id, [Match.State.NEWBORN])
 
-    def test_round_will_finish(self):
+    def test_turn_is_checked_in_one_query(self):
         self.start_match('user1')
 
-        round_duration = 1
-        total_round = random.randint(5, 10)
-        match = Match.objects.get(pk=1)
-        match.round_duration_seconds = round_duration
-        match.total_round_count = total_round
-        match.save()
+        with self.assertNumQueries(1):
+            room = self.check_turn('user1')
+            self.assertEqual(Match.State.NEWBORN, room.match.state)
+            self.assertEqual(Room.Teams.ONE_TWO__THREE_FOUR, room.teams)
 
-        for i in range(total_round):
-            current_round = i + 1
-            last_round = (current_round == total_round)
+    def test_turn_check_errors(self):
+        with self.assertRaises(Http404):
+            self.check_turn('user1', room_id=2)
+        with self.assertRaises(PermissionDenied):
+            self.check_turn('user5')
+        with self.assertRaises(LogicError):
+            self.check_turn('user1')
 
-            explaining_player = self.get_explaining_player()
-            token = self.users[explaining_player].auth_token
-            response = self.client.post(
-                reverse('play', args=[1]),
-                HTTP_AUTHORIZATION=f'Token {token}',
-            )
+        self.start_match('user1')
+        with self.assertRaises(PermissionDenied):
+            self.check_turn('user2')
 
-            self.assertEqual(status.HTTP_200_OK, response.status_code)
+    def test_benchmark_command(self):
+        self.start_match('user1')
+        out = io.StringIO()
 
-            time.sleep(round_duration + 1)
+        call_command('benchturn', iterations=5, stdout=out)
 
-            response = self.get_room()
-            self.assertEqual(
-                Match.State.FINISHED if last_round else Match.State.WAITING,
-                response.data['match']['state']
-            )
-            if not last_round:
-                self.assertEqual(
-                    current_round % 4,
-                    response.data['match']['current_turn']
-                )
-                self.assertEqual(
-                    current_round + 1,
-                    response.data['match']['current_round']
-                )
+        self.assertIn('1 queries per call', out.getvalue())
+        self.assertEqual(1, Room.objects.count())
 
 
-class PushNotificationTestCase(get_equipped_test_case(APITransactionTestCase)):
-    reset_sequences = True
+class WordBankTestCase(get_equipped_test_case()):
 
     def setUp(self):
         super().setUp()
         self.create_words(self.words)
 
-        for i in range(6):
-            self.create_user(username=f'user{i}')
-        self.communicators = []
+    def test_bank_contains_all_words(self):
+        bank = get_word_bank()
 
-    async def clear(self):
+        self.assertEqual(len(self.words), len(bank))
+        for word in Word.objects.all():
+            self.assertEqual(
+                (word.id, word.text, word.complexity),
+                tuple(bank.get(word.id))
+            )
 
-        @database_sync_to_async
-        def clear_tables():
-            Room.objects.all().delete()
-            Match.objects.all().delete()
-            SelectedWord.objects.all().delete()
+        self.assertIsNone(bank.get(Word.objects.latest('id').id + 1))
 
-        await clear_tables()
-        for communicator in self.communicators:
-            await communicator.disconnect()
+    def test_drawing_words_does_not_query_database(self):
+        bank = get_word_bank()
+        match = Match(state=Match.State.NEWBORN)
 
-        self.communicators.clear()
+        with self.assertNumQueries(0):
+            for _ in range(len(self.words)):
+                word = draw_word(match)
+                self.assertEqual(word, bank.get(word.id))
 
-    async def get_ticket(self, username, room_id=1):
-        response = await self.async_client.get(
-            reverse('get_ticket', args=[room_id]),
-            AUTHORIZATION=f'Token {self.users[username].auth_token}',
-        )
+    def test_match_never_draws_repeated_words(self):
+        match = Match(state=Match.State.NEWBORN)
 
-        return response.data['ticket']
+        drawn = [draw_word(match).id for _ in range(len(self.words))]
 
-    def get_room_websocket_application(self):
-        return TicketAuthMiddlewareStack(
-            URLRouter(
-                websocket_urlpatterns
-            )
+        self.assertCountEqual(
+            Word.objects.values_list('id', flat=True),
+            drawn
         )
 
-    async def get_communicator(self, room_id: int, username: str):
-        ticket = await self.get_ticket(username, room_id)
-        communicator = WebsocketCommunicator(
-            self.get_room_websocket_application(),
-            f'rooms/{room_id}?ticket={ticket}'
-        )
-        connected, subprotocol = await communicator.connect()
-        self.assertTrue(connected)
+    def test_match_deck_survives_worker_restart(self):
+        room = Room.objects.create(name='Room1')
+        match = Match.objects.create(room=room, state=Match.State.NEWBORN)
 
-        self.communicators.append(communicator)
+        drawn = [draw_word(match).id for _ in range(len(self.words) // 2)]
+        match.save()
 
-        return communicator
+        word_banks.clear()
+        match = Match.objects.get(pk=room.pk)
+        drawn += [
+            draw_word(match).id
+            for _ in range(len(self.words) - len(drawn))
+        ]
 
-    async def test_player_should_not_establish_socket_to_not_existing_room(
-        self
-    ):
-        communicator = WebsocketCommunicator(
-            self.get_room_websocket_application(),
-            'rooms/1'
+        self.assertCountEqual(
+            Word.objects.values_list('id', flat=True),
+            drawn
         )
-        connected, subprotocol = await communicator.connect()
-        self.assertFalse(connected)
-        await communicator.disconnect()
 
-        await self.clear()
+    def test_exhausted_deck_is_reshuffled(self):
+        match = Match(state=Match.State.NEWBORN)
+        for _ in range(len(self.words)):
+            draw_word(match)
+        seed = match.deck_seed
 
-    async def test_player_should_not_establish_socket_without_ticket(self):
-        await sync_to_async(self.create_sample_room)(creator='user1')
+        self.assertIsNotNone(draw_word(match))
+        self.assertNotEqual(seed, match.deck_seed)
 
-        communicator = WebsocketCommunicator(
-            self.get_room_websocket_application(),
-            'rooms/1'
-        )
-        connected, subprotocol = await communicator.connect()
-        self.assertFalse(connected)
-        await communicator.disconnect()
+    def test_no_word_is_drawn_from_empty_bank(self):
+        self.remove_words()
+        word_banks.clear()
 
-        await self.clear()
+        self.assertIsNone(draw_word(Match(state=Match.State.NEWBORN)))
 
-    async def test_player_should_not_establish_socket_with_invalid_ticket(
-        self
-    ):
-        await sync_to_async(self.create_sample_room)(creator='user1')
+    def test_shuffled_position_is_a_permutation(self):
+        for size in range(1, 70):
+            seed = random.getrandbits(63)
+            self.assertCountEqual(
+                range(size),
+                [shuffled_position(i, size, seed) for i in range(size)]
+            )
 
-        communicator = WebsocketCommunicator(
-            self.get_room_websocket_application(),
-            'rooms/1?ticket=invalidticketrandom'
+
+class WordBankVersionTestCase(get_equipped_test_case()):
+
+    def setUp(self):
+        super().setUp()
+        self.create_words(self.words)
+
+    @override_settings(WORD_BANK_VERSION_CHECK_INTERVAL_SECONDS=0)
+    def test_published_version_is_picked_up_on_next_draw(self):
+        bank = get_word_bank()
+
+        self.create_words([('lantern', 1)])
+        version = publish_word_bank()
+
+        new_bank = get_word_bank()
+        self.assertEqual(version, new_bank.version)
+        self.assertNotEqual(bank.version, new_bank.version)
+        self.assertEqual(len(self.words) + 1, len(new_bank))
+
+    @override_settings(WORD_BANK_VERSION_CHECK_INTERVAL_SECONDS=0)
+    def test_new_version_is_loaded_in_background(self):
+        registry = WordBankRegistry()
+        proceed = threading.Event()
+        loads = []
+
+        def load_word_bank(version):
+            if loads:
+                proceed.wait(5)
+            loads.append(version)
+            return WordBank([], version=version)
+
+        with mock.patch('core.words.load_word_bank', load_word_bank):
+            bank = registry.current()
+            version = publish_word_bank()
+
+            self.assertIs(bank, registry.current())
+            self.assertIs(bank, registry.current())
+
+            proceed.set()
+            for _ in range(100):
+                if registry.current().version == version:
+                    break
+                time.sleep(0.05)
+
+        self.assertEqual(version, registry.current().version)
+        self.assertEqual([bank.version, version], loads)
+
+    @override_settings(WORD_BANK_VERSION_CHECK_INTERVAL_SECONDS=60)
+    def test_version_is_not_checked_before_interval(self):
+        bank = get_word_bank()
+        publish_word_bank()
+
+        with self.assertNumQueries(0):
+            self.assertIs(bank, get_word_bank())
+
+    @override_settings(WORD_BANK_VERSION_CHECK_INTERVAL_SECONDS=0)
+    def test_match_stays_pinned_to_its_version(self):
+        match = Match(state=Match.State.NEWBORN)
+        drawn = [draw_word(match).id for _ in range(len(self.words) // 2)]
+        version = match.word_bank_version
+
+        self.create_words([('lantern', 1), ('harbor', 2), ('quartz', 3)])
+        publish_word_bank()
+
+        drawn += [
+            draw_word(match).id
+            for _ in range(len(self.words) - len(drawn))
+        ]
+
+        self.assertEqual(version, match.word_bank_version)
+        self.assertCountEqual(
+            Word.objects.exclude(
+                text__in=['lantern', 'harbor', 'quartz']
+            ).values_list('id', flat=True),
+            drawn
         )
-        connected, subprotocol = await communicator.connect()
-        self.assertFalse(connected)
-        await communicator.disconnect()
 
-        await self.clear()
+    @override_settings(WORD_BANK_VERSION_CHECK_INTERVAL_SECONDS=0)
+    def test_match_moves_to_current_version_when_not_retained(self):
+        match = Match(state=Match.State.NEWBORN)
+        draw_word(match)
 
-    @override_settings(TICKET_VALIDITY_PERIOD_SECONDS=2)
-    @async_to_sync
-    async def test_player_should_not_establish_socket_with_expired_ticket(
+        publish_word_bank()
+        word_banks.clear()
+        draw_word(match)
+
+        self.assertEqual(get_word_bank().version, match.word_bank_version)
+
+    def test_importing_words_publishes_new_version(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as csv_file:
+            csv_file.write('text,complexity\nlantern,1\nharbor,2\n')
+            csv_file.flush()
+            call_command('importwords', csv_file.name, stdout=io.StringIO(),
+                         verbosity=0)
+
+        self.assertEqual(1, WordBankVersion.objects.count())
+        self.assertEqual(
+            2,
+            sum(len(bucket) for bucket in get_word_bank().buckets.values())
+        )
+
+
+class ImportWordsTestCase(get_equipped_test_case()):
+
+    def import_words(self, content: str, **options) -> str:
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as csv_file:
+            csv_file.write(content)
+            csv_file.flush()
+            stdout = io.StringIO()
+            call_command('importwords', csv_file.name, stdout=stdout,
+                         verbosity=0, **options)
+        return stdout.getvalue()
+
+    def test_words_are_imported_in_chunks(self):
+        self.create_words(self.words)
+        rows = [(f'word{i}', i % 3 + 1) for i in range(25)]
+
+        output = self.import_words(
+            'text,complexity\n' + ''.join(
+                f'{text},{complexity}\n' for text, complexity in rows),
+            chunk_size=4,
+            replace=True
+        )
+
+        self.assertCountEqual(
+            rows,
+            Word.objects.values_list('text', 'complexity')
+        )
+        self.assertIn('rows/s', output)
+        self.assertIn('peak memory', output)
+
+    def test_merge_writes_only_changed_rows(self):
+        self.import_words('text,complexity\nlantern,1\nharbor,2\nquartz,3\n')
+        harbor = Word.objects.get(text='harbor')
+
+        with CaptureQueriesContext(connection) as context:
+            output = self.import_words(
+                'text,complexity\nlantern,1\nharbor,3\nquartz,3\n')
+
+        writes = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+        self.assertEqual(2, len(writes))  # the word and published version
+        self.assertIn('Updated 1 words', output)
+        self.assertEqual(3, Word.objects.get(pk=harbor.pk).complexity)
+
+    def test_merge_retires_missing_words_and_keeps_history(self):
+        self.import_words('text,complexity\nlantern,1\nharbor,2\n')
+        room = Room.objects.create(name='Room1')
+        match = Match.objects.create(room=room, state=Match.State.PLAYING)
+        harbor = Word.objects.get(text='harbor')
+        SelectedWord.objects.create(text=harbor, match=match)
+
+        self.import_words('text,complexity\nlantern,1\n quartz ,3\n')
+
+        self.assertTrue(Word.objects.get(pk=harbor.pk).retired)
+        self.assertEqual(1, SelectedWord.objects.count())
+        self.assertCountEqual(
+            ['lantern', 'quartz'],
+            Word.objects.filter(retired=False).values_list('text', flat=True)
+        )
+
+        match = Match(state=Match.State.NEWBORN)
+        self.assertCountEqual(
+            ['lantern', 'quartz'],
+            [draw_word(match).text for _ in range(2)]
+        )
+        self.assertEqual('harbor', get_word_bank().get(harbor.pk).text)
+
+        self.import_words('text,complexity\nlantern,1\nharbor,2\n')
+        self.assertFalse(Word.objects.get(pk=harbor.pk).retired)
+
+    def test_unchanged_merge_does_not_publish_version(self):
+        self.import_words('text,complexity\nlantern,1\n')
+        self.import_words('text,complexity\nlantern,1\nlantern,1\n')
+
+        self.assertEqual(1, WordBankVersion.objects.count())
+        self.assertEqual(1, Word.objects.count())
+
+    def test_merge_takes_first_row_of_repeated_texts(self):
+        self.import_words('text,complexity\nharbor,1\n')
+        self.import_words(
+            'text,complexity\nlantern,1\nharbor,2\nlantern,3\nharbor,3\n',
+            chunk_size=1
+        )
+
+        self.assertCountEqual(
+            [('lantern', 1), ('harbor', 2)],
+            Word.objects.values_list('text', 'complexity')
+        )
+
+    def test_key_set(self):
+        keys = KeySet()
+        for start in range(0, 100, 7):
+            keys.add(np.arange(start, start + 7, dtype=np.uint64) * 2)
+
+        self.assertLessEqual(len(keys.levels), 5)
+        self.assertEqual(
+            [True, False, True, False],
+            keys.contains(np.array([0, 1, 208, 210], dtype=np.uint64)).tolist()
+        )
+
+    def test_texts_are_not_parsed_as_missing_values(self):
+        self.import_words('text,complexity\nnull,1\nNA,2\n')
+
+        self.assertCountEqual(
+            [('null', 1), ('NA', 2)],
+            Word.objects.values_list('text', 'complexity')
+        )
+
+    def test_invalid_row_keeps_existing_words(self):
+        self.create_words(self.words)
+
+        with self.assertRaisesMessage(CommandError, 'row'):
+            self.import_words(
+                'text,complexity\nlantern,1\nharbor,7\n',
+                chunk_size=1
+            )
+
+        self.assertEqual(len(self.words), Word.objects.count())
+
+    def test_missing_column_is_reported(self):
+        with self.assertRaisesMessage(CommandError, '`text`'):
+            self.import_words('word,complexity\nlantern,1\n')
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class WordsFileJobTestCase(get_equipped_test_case()):
+
+    def upload(self, content: str) -> WordsFile:
+        return WordsFile.objects.create(
+            csv_file=ContentFile(content.encode(), name='words.csv'))
+
+    def tearDown(self):
+        for words_file in WordsFile.objects.all():
+            words_file.csv_file.delete(save=False)
+
+    def test_upload_is_imported_in_background(self):
+        words_file = self.upload('text,complexity\nlantern,1\nharbor,2\n')
+
+        self.assertEqual(WordsFile.Status.PENDING, words_file.status)
+        self.assertEqual(0, Word.objects.count())
+
+        run_words_file_worker(once=True)
+
+        words_file.refresh_from_db()
+        self.assertEqual(WordsFile.Status.DONE, words_file.status)
+        self.assertEqual(2, words_file.read_rows)
+        self.assertEqual(2, words_file.inserted_words)
+        self.assertIsNotNone(words_file.finished_at)
+        self.assertEqual(2, Word.objects.count())
+        self.assertEqual(1, WordBankVersion.objects.count())
+
+    def test_invalid_upload_fails_with_error(self):
+        words_file = self.upload('text,complexity\nlantern,7\n')
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            run_words_file_worker(once=True)
+
+        words_file.refresh_from_db()
+        self.assertEqual(WordsFile.Status.FAILED, words_file.status)
+        self.assertIn('lantern', words_file.error)
+        self.assertEqual(0, Word.objects.count())
+
+    @override_settings(WORDS_FILE_CHUNK_SIZE=2)
+    def test_failed_upload_leaves_words_unchanged(self):
+        self.create_words([('lantern', 1)])
+        words_file = self.upload(
+            'text,complexity\nharbor,1\nquartz,1\nmask,9\n')
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            run_words_file_worker(once=True)
+
+        words_file.refresh_from_db()
+        self.assertEqual(WordsFile.Status.FAILED, words_file.status)
+        self.assertEqual(
+            [('lantern', False)],
+            list(Word.objects.values_list('text', 'retired'))
+        )
+        self.assertEqual(0, WordBankVersion.objects.count())
+
+    def test_file_is_claimed_once(self):
+        words_file = self.upload('text,complexity\nlantern,1\n')
+
+        self.assertEqual(words_file.pk, claim_words_file().pk)
+        self.assertIsNone(claim_words_file())
+
+    @override_settings(WORDS_FILE_JOB_TIMEOUT_SECONDS=0)
+    def test_abandoned_file_is_claimed_again(self):
+        words_file = self.upload('text,complexity\nlantern,1\n')
+        claim_words_file()
+
+        self.assertEqual(words_file.pk, claim_words_file().pk)
+
+
+class SchedulerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(name='test_scheduler')
+        self.calls = []
+        self.done = threading.Event()
+
+    def record(self, value, last=False):
+        self.calls.append(value)
+        if last:
+            self.done.set()
+
+    def test_calls_run_in_deadline_order(self):
+        now = timezone.now()
+        self.scheduler.schedule(
+            now + timedelta(milliseconds=300), self.record, 3, True)
+        self.scheduler.schedule(
+            now + timedelta(milliseconds=100), self.record, 1)
+        self.scheduler.schedule(
+            now + timedelta(milliseconds=200), self.record, 2)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([1, 2, 3], self.calls)
+
+    def test_call_with_same_key_is_replaced(self):
+        now = timezone.now()
+        self.scheduler.schedule(
+            now + timedelta(milliseconds=100), self.record, 1, key='room')
+        self.scheduler.schedule(
+            now + timedelta(milliseconds=200), self.record, 2, True,
+            key='room')
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([2], self.calls)
+
+    def test_cancelled_call_is_not_run(self):
+        now = timezone.now()
+        self.scheduler.schedule(
+            now + timedelta(milliseconds=100), self.record, 1, key='room')
+        self.scheduler.cancel('room')
+        self.scheduler.schedule(
+            now + timedelta(milliseconds=200), self.record, 2, True)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([2], self.calls)
+
+    def test_single_thread_serves_all_calls(self):
+        threads = threading.active_count()
+        deadline = timezone.now() + timedelta(hours=1)
+
+        for room_id in range(5000):
+            self.scheduler.schedule(
+                deadline, self.record, room_id, key=room_id)
+
+        self.assertEqual(5000, len(self.scheduler))
+        self.assertEqual(threads + 1, threading.active_count())
+
+    def test_lateness_is_recorded(self):
+        count = self.scheduler.lateness.count
+        self.scheduler.schedule(
+            timezone.now() + timedelta(milliseconds=50), self.record, 1, True)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(count + 1, self.scheduler.lateness.count)
+        # the call is fired well within a second of its deadline
+        self.assertLess(self.scheduler.lateness.sum, 1)
+
+
+class RoomPublisherTestCase(SimpleTestCase):
+    def test_deltas_are_merged(self):
+        self.assertEqual(
+            {
+                'players': ['user1', 'user2'],
+                'match': {
+                    'state': Match.State.PLAYING,
+                    'team_one_score': 1,
+                    'word': {'index': 0, 'text': 'mask'},
+                },
+            },
+            merge_deltas(
+                {
+                    'players': ['user1'],
+                    'match': {'state': Match.State.PLAYING},
+                },
+                {
+                    'players': ['user1', 'user2'],
+                    'match': {
+                        'team_one_score': 1,
+                        'word': {'index': 0, 'text': 'mask'},
+                    },
+                }
+            )
+        )
+
+    def test_word_is_put_in_whole_match(self):
+        self.assertEqual(
+            {'match': {'words': [{'text': 'mask'}, {'text': 'pop'}]}},
+            merge_deltas(
+                {'match': {'words': [{'text': 'mask'}]}},
+                {'match': {'word': {'index': 1, 'text': 'pop'}}}
+            )
+        )
+
+    def test_different_words_are_not_merged(self):
+        events = [
+            (3, {'match': {'word': {'index': 1, 'text': 'pop'}}}),
+            (1, {'match': {'word': {'index': 0, 'text': 'mask'}}}),
+            (2, {'match': {'team_one_score': 1}}),
+        ]
+        self.assertEqual(
+            [
+                {
+                    'first_seq': 1,
+                    'seq': 2,
+                    'data': {'match': {
+                        'word': {'index': 0, 'text': 'mask'},
+                        'team_one_score': 1,
+                    }},
+                },
+                {'first_seq': 3, 'seq': 3, 'data': events[0][1]},
+            ],
+            coalesce_events(events)
+        )
+
+    def test_publisher_loop_keeps_running(self):
+        publisher_loop = PublisherLoop(name='test_publisher')
+        calls = []
+        done = threading.Event()
+
+        async def call(name):
+            if name == 'failing':
+                raise ValueError()
+            calls.append((
+                name,
+                asyncio.get_running_loop(),
+                threading.current_thread().name
+            ))
+            if len(calls) == 2:
+                done.set()
+
+        with self.assertLogs('core.publisher', 'ERROR'):
+            publisher_loop.call_later(0.05, call, 'second')
+            publisher_loop.call_later(0, call, 'failing')
+            publisher_loop.call_later(0, call, 'first')
+
+            self.assertTrue(done.wait(1))
+        self.assertEqual(['first', 'second'], [name for name, *_ in calls])
+        self.assertIs(calls[0][1], calls[1][1])
+        self.assertEqual('test_publisher', calls[0][2])
+
+
+@override_settings(HANDSHAKE_CONCURRENCY=1, HANDSHAKE_QUEUE_SECONDS=0.2)
+class HandshakeAdmissionTestCase(SimpleTestCase):
+    def setUp(self):
+        self.proceed = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await receive()
+            await send({'type': 'websocket.accept'})
+            # Slot is held until the app asks for the next message
+            await self.proceed.wait()
+            while (await receive())['type'] != 'websocket.disconnect':
+                pass
+
+        self.application = TicketAuthMiddleware(app)
+
+    async def test_handshake_is_rejected_after_queue_deadline(self):
+        rejected = admission.rejected.value
+        first = WebsocketCommunicator(self.application, 'rooms/1')
+        self.assertTrue((await first.connect())[0])
+
+        second = WebsocketCommunicator(self.application, 'rooms/1')
+        await second.connect()
+        message = await second.receive_json_from()
+        self.assertEqual('retry', message['type'])
+        self.assertGreaterEqual(
+            message['after'], settings.HANDSHAKE_RETRY_AFTER_SECONDS)
+        self.assertLessEqual(
+            message['after'], 2 * settings.HANDSHAKE_RETRY_AFTER_SECONDS)
+        self.assertEqual({
+            'type': 'websocket.close',
+            'code': RETRY_LATER_CLOSE_CODE,
+        }, await second.receive_output())
+        self.assertEqual(rejected + 1, admission.rejected.value)
+
+        self.proceed.set()
+        await first.disconnect()
+        self.assertEqual(0, admission.active)
+
+    async def test_queued_handshake_is_admitted_when_slot_is_free(self):
+        queued = admission.queued.value
+        first = WebsocketCommunicator(self.application, 'rooms/1')
+        await first.connect()
+
+        second = WebsocketCommunicator(self.application, 'rooms/1')
+        connecting = asyncio.ensure_future(second.connect())
+        await asyncio.sleep(0.05)
+        self.assertEqual(queued + 1, admission.queued.value)
+        self.proceed.set()
+        self.assertTrue((await connecting)[0])
+        self.assertTrue(await second.receive_nothing())
+
+        await first.disconnect()
+        await second.disconnect()
+        self.assertEqual(0, admission.active)
+
+
+class EncodingTestCase(SimpleTestCase):
+    def test_known_subprotocol_is_negotiated(self):
+        self.assertEqual(
+            'gerd.msgpack.v1',
+            negotiate(['gerd.unknown', 'gerd.msgpack.v1'])
+        )
+        self.assertIsNone(negotiate(['gerd.unknown']))
+        self.assertIsNone(negotiate([]))
+
+    def test_message_is_encoded_once_per_encoding(self):
+        message = {
+            'type': 'delta',
+            'seq': 1,
+            'data': {'match': {'words': [{'text': 'mask'}]}, 'extra': 1},
+        }
+        frames = encode_all(message)
+
+        self.assertEqual(message, json.loads(frames['json']))
+        self.assertEqual({
+            KEY_CODES['type']: 'delta',
+            KEY_CODES['seq']: 1,
+            KEY_CODES['data']: {
+                KEY_CODES['match']: {
+                    KEY_CODES['words']: [{KEY_CODES['text']: 'mask'}],
+                },
+                'extra': 1,
+            },
+        }, msgpack.unpackb(frames['msgpack'], strict_map_key=False))
+        self.assertLess(len(frames['msgpack']), len(frames['json']))
+
+
+class FakeRedis:
+    """
+    Just enough of a Redis connection for group operations of
+    `RedisChannelLayer`, recording what is written
+    """
+
+    def __init__(self):
+        self.groups = defaultdict(dict)
+        self.writes = []
+        # Messages sent to this process through Redis
+        self.messages = []
+
+    async def zadd(self, key, score, member):
+        if isinstance(member, str):
+            member = member.encode()
+        self.groups[key][member] = score
+
+    async def zpopmin(self, key):
+        pass
+
+    async def expire(self, key, seconds):
+        pass
+
+    async def zrem(self, key, member):
+        self.groups[key].pop(member.encode(), None)
+
+    async def zremrangebyscore(self, key, min, max):
+        pass
+
+    async def zrange(self, key, start, stop):
+        return list(self.groups[key])
+
+    def pipeline(self):
+        return mock.Mock(execute=mock.AsyncMock())
+
+    async def eval(self, script, keys, args):
+        if keys:
+            self.writes.append(keys)
+        return 0
+
+    async def bzpopmin(self, key, timeout):
+        if self.messages:
+            return key, self.messages.pop(0), time.time()
+        await asyncio.sleep(timeout)
+
+
+class LocalFirstChannelLayerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.layer = LocalFirstChannelLayer()
+        self.redis = FakeRedis()
+
+        @asynccontextmanager
+        async def connection(index):
+            yield self.redis
+
+        self.layer.connection = connection
+
+    async def test_local_members_get_message_without_redis_writes(self):
+        channels = [await self.layer.new_channel() for _ in range(4)]
+        for channel in channels:
+            await self.layer.group_add('room_1', channel)
+
+        await self.layer.group_send('room_1', {'type': 'room_event'})
+
+        self.assertEqual([], self.redis.writes)
+        for channel in channels:
+            self.assertEqual(
+                {'type': 'room_event'},
+                await asyncio.wait_for(self.layer.receive(channel), 1)
+            )
+
+    async def test_remote_members_get_message_through_redis(self):
+        local = await self.layer.new_channel()
+        remote = 'specific.otherprocess!abc'
+        await self.layer.group_add('room_1', local)
+        await self.layer.group_add('room_1', remote)
+
+        await self.layer.group_send('room_1', {'type': 'room_event'})
+
+        self.assertEqual([['asgispecific.otherprocess!']], self.redis.writes)
+        self.assertEqual(
+            {'type': 'room_event'},
+            await asyncio.wait_for(self.layer.receive(local), 1)
+        )
+
+    async def test_messages_through_redis_are_received(self):
+        channels = [await self.layer.new_channel() for _ in range(2)]
+        self.redis.messages.append(self.layer.serialize({
+            'type': 'room_event',
+            '__asgi_channel__': channels,
+        }))
+
+        for channel in channels:
+            self.assertEqual(
+                {'type': 'room_event'},
+                await asyncio.wait_for(self.layer.receive(channel), 1)
+            )
+
+    async def test_discarded_members_do_not_get_message(self):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add('room_1', channel)
+        await self.layer.group_discard('room_1', channel)
+
+        await self.layer.group_send('room_1', {'type': 'room_event'})
+
+        self.assertTrue(self.layer.receive_buffer[channel].empty())
+        self.assertEqual({}, self.layer.local_groups)
+
+    async def test_pump_survives_failed_receive(self):
+        channel = await self.layer.new_channel()
+        self.layer.pump_retry_delay = 0.01
+        bzpopmin = self.redis.bzpopmin
+        failures = [ConnectionError('Connection reset by peer')]
+
+        async def failing_once(key, timeout):
+            if failures:
+                raise failures.pop()
+            return await bzpopmin(key, timeout)
+
+        self.redis.bzpopmin = failing_once
+        self.redis.messages.append(self.layer.serialize({
+            'type': 'room_event',
+            '__asgi_channel__': [channel],
+        }))
+
+        with self.assertLogs('core.layers', 'ERROR'):
+            message = await asyncio.wait_for(self.layer.receive(channel), 1)
+
+        self.assertEqual({'type': 'room_event'}, message)
+
+    def test_message_from_another_thread_wakes_receiver(self):
+        async def receive():
+            channel = await self.layer.new_channel()
+            await self.layer.group_add('room_1', channel)
+            receiving = asyncio.ensure_future(self.layer.receive(channel))
+            await asyncio.sleep(0.05)
+
+            thread = threading.Thread(target=async_to_sync(
+                self.layer.group_send), args=['room_1', {'type': 'x'}])
+            thread.start()
+            message = await asyncio.wait_for(receiving, 1)
+            thread.join()
+            return message
+
+        self.assertEqual({'type': 'x'}, async_to_sync(receive)())
+
+
+class MetricsTestCase(get_equipped_test_case()):
+
+    def test_histogram_is_rendered_cumulatively(self):
+        registry = Registry()
+        histogram = registry.histogram(
+            'lag_seconds', 'Lag', buckets=[0.1, 1])
+        for value in [0.05, 0.5, 0.7, 3]:
+            histogram.observe(value)
+        registry.counter('calls_total', 'Calls').inc()
+
+        self.assertIs(histogram, registry.histogram('lag_seconds', 'Lag'))
+        lines = registry.render().splitlines()
+        self.assertIn('lag_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('lag_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('lag_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('lag_seconds_count 4', lines)
+        self.assertIn('calls_total 1', lines)
+
+    def test_histogram_bucket_bounds_are_inclusive(self):
+        histogram = Histogram('lag_seconds', 'Lag', buckets=[1])
+        histogram.observe(1)
+
+        self.assertEqual([1, 0], histogram.counts)
+
+    def test_only_admins_can_read_metrics(self):
+        self.create_user()
+        response = self.client.get(
+            reverse('metrics'),
+            HTTP_AUTHORIZATION=f'Token {self.users["user"].auth_token}',
+        )
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+        admin = self.users['user']
+        admin.is_staff = True
+        admin.save()
+        response = self.client.get(
+            reverse('metrics'),
+            HTTP_AUTHORIZATION=f'Token {admin.auth_token}',
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertIn(
+            b'round_scheduler_lateness_seconds_count', response.content)
+
+
+@mock.patch('core.views.round_scheduler')
+class RoundRecoveryTestCase(get_equipped_test_case()):
+
+    def create_playing_match(self, deadline: datetime) -> Match:
+        room = Room.objects.create(name='Room1')
+        return Match.objects.create(
+            room=room,
+            state=Match.State.PLAYING,
+            current_turn=0,
+            current_round=1,
+            round_start_time=deadline - timedelta(seconds=100),
+            round_deadline=deadline,
+        )
+
+    def test_sweeper_finishes_overdue_rounds(self, round_scheduler):
+        overdue = self.create_playing_match(
+            timezone.now() - timedelta(seconds=5))
+        playing = self.create_playing_match(
+            timezone.now() + timedelta(seconds=50))
+
+        sweep_overdue_rounds()
+
+        overdue.refresh_from_db()
+        self.assertEqual(Match.State.WAITING, overdue.state)
+        self.assertEqual(2, overdue.current_round)
+        self.assertIsNone(overdue.round_deadline)
+
+        playing.refresh_from_db()
+        self.assertEqual(Match.State.PLAYING, playing.state)
+        self.assertEqual(1, playing.current_round)
+
+        round_scheduler.schedule.assert_called_once()
+
+    def test_sweeper_uses_single_query_when_nothing_is_overdue(
+        self,
+        round_scheduler
+    ):
+        self.create_playing_match(timezone.now() + timedelta(seconds=50))
+
+        with self.assertNumQueries(1):
+            sweep_overdue_rounds()
+
+    def test_scheduled_round_is_finished_when_wall_clock_is_behind(
+        self,
+        round_scheduler
+    ):
+        match = self.create_playing_match(
+            timezone.now() + timedelta(seconds=5))
+
+        finish_round(match.pk)
+        match.refresh_from_db()
+        self.assertEqual(Match.State.PLAYING, match.state)
+
+        finish_round(match.pk, 1)
+        match.refresh_from_db()
+        self.assertEqual(Match.State.WAITING, match.state)
+        self.assertEqual(2, match.current_round)
+
+    def test_scheduled_call_of_another_round_is_ignored(
+        self,
+        round_scheduler
+    ):
+        match = self.create_playing_match(
+            timezone.now() + timedelta(seconds=5))
+        match.current_round = 2
+        match.save()
+
+        finish_round(match.pk, 1)
+
+        match.refresh_from_db()
+        self.assertEqual(Match.State.PLAYING, match.state)
+        self.assertEqual(2, match.current_round)
+
+    def test_round_is_finished_once(self, round_scheduler):
+        match = self.create_playing_match(
+            timezone.now() - timedelta(seconds=5))
+
+        finish_round(match.pk)
+        finish_round(match.pk)
+
+        match.refresh_from_db()
+        self.assertEqual(2, match.current_round)
+
+    def test_round_is_not_finished_before_deadline(self, round_scheduler):
+        match = self.create_playing_match(
+            timezone.now() + timedelta(seconds=50))
+
+        finish_round(match.pk)
+
+        match.refresh_from_db()
+        self.assertEqual(Match.State.PLAYING, match.state)
+
+
+class ConcurrentScoringTestCase(
+    get_equipped_test_case(APITransactionTestCase)
+):
+    reset_sequences = True
+
+    def setUp(self):
+        super().setUp()
+        for i in range(1, 5):
+            self.create_user(username=f'user{i}')
+
+        self.create_sample_room(creator='user1')
+        for i in range(1, 5):
+            self.join_room(f'user{i}')
+        self.create_words(self.words)
+        self.start_match('user1')
+
+        match = Match.objects.get(pk=1)
+        match.state = Match.State.PLAYING
+        match.round_deadline = timezone.now() - timedelta(seconds=1)
+        match.save()
+
+    def run_concurrently(self, target, count: int) -> None:
+        def run(i):
+            try:
+                target(i)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=run, args=[i]) for i in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @staticmethod
+    def retry_while_locked(function):
+        # SQLite test database refuses concurrent writers instead of
+        # making them wait
+        while True:
+            try:
+                return function()
+            except OperationalError:
+                time.sleep(0.001)
+
+    def test_concurrent_increments_are_not_lost(self):
+        threads, increments = 8, 25
+
+        def add_scores(i):
+            # Every thread works on its own, soon stale, copy of match
+            room = Room.objects.select_related('match').get(pk=1)
+            for _ in range(increments):
+                self.retry_while_locked(lambda: update_match(
+                    room.match,
+                    [Match.State.PLAYING],
+                    **get_score_increment(room, 1)
+                ))
+
+        self.run_concurrently(add_scores, threads)
+
+        match = Match.objects.get(pk=1)
+        self.assertEqual(threads * increments, match.team_one_score)
+        self.assertEqual(Match.State.PLAYING, match.state)
+
+    def test_round_is_finished_once(self):
+        finished = []
+
+        def finish(i):
+            room = Room.objects.select_related('match').get(pk=1)
+            try:
+                self.retry_while_locked(lambda: update_match(
+                    room.match,
+                    [Match.State.PLAYING],
+                    state=Match.State.WAITING,
+                    current_round=room.match.current_round + 1,
+                ))
+                finished.append(i)
+            except LogicError:
+                pass
+
+        self.run_concurrently(finish, 8)
+
+        self.assertEqual(1, len(finished))
+        self.assertEqual(2, Match.objects.get(pk=1).current_round)
+
+    def test_score_of_finished_round_is_rejected(self):
+        room = Room.objects.select_related('match').get(pk=1)
+
+        finish_round(1)
+
+        with self.assertRaises(LogicError):
+            update_match(
+                room.match,
+                [Match.State.PLAYING],
+                **get_score_increment(room, 3)
+            )
+        match = Match.objects.get(pk=1)
+        self.assertEqual(Match.State.WAITING, match.state)
+        self.assertEqual(0, match.team_one_score)
+
+
+class RoundTestCase(get_equipped_test_case(APITransactionTestCase)):
+    reset_sequences = True
+
+    def setUp(self):
+        super().setUp()
+        for i in range(6):
+            self.create_user(username=f'user{i}')
+
+        self.create_sample_room(creator='user1')
+        room = Room.objects.get(pk=1)
+        room.teams = Room.Teams.ONE_THREE__TWO_FOUR
+        room.save()
+
+        self.join_room('user1')
+        self.join_room('user2')
+        self.join_room('user3')
+        self.join_room('user4')
+
+        self.create_words(self.words)
+
+    def test_round_will_finish(self):
+        self.start_match('user1')
+
+        round_duration = 1
+        total_round = random.randint(5, 10)
+        match = Match.objects.get(pk=1)
+        match.round_duration_seconds = round_duration
+        match.total_round_count = total_round
+        match.save()
+
+        for i in range(total_round):
+            current_round = i + 1
+            last_round = (current_round == total_round)
+
+            explaining_player = self.get_explaining_player()
+            token = self.users[explaining_player].auth_token
+            response = self.client.post(
+                reverse('play', args=[1]),
+                HTTP_AUTHORIZATION=f'Token {token}',
+            )
+
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+            time.sleep(round_duration + 1)
+
+            response = self.get_room()
+            self.assertEqual(
+                Match.State.FINISHED if last_round else Match.State.WAITING,
+                response.data['match']['state']
+            )
+            if not last_round:
+                self.assertEqual(
+                    current_round % 4,
+                    response.data['match']['current_turn']
+                )
+                self.assertEqual(
+                    current_round + 1,
+                    response.data['match']['current_round']
+                )
+
+
+class ImmediateLoop:
+    """
+    Run coroutine functions at once in the calling thread, or keep them
+    until `resume` while paused
+    """
+
+    def __init__(self):
+        self.paused = False
+        self.calls = []
+
+    def call_later(self, delay, func, *args):
+        if self.paused:
+            self.calls.append((func, args))
+        else:
+            async_to_sync(func)(*args)
+
+    def resume(self):
+        self.paused = False
+        calls, self.calls = self.calls, []
+        for func, args in calls:
+            async_to_sync(func)(*args)
+
+
+class PushNotificationTestCase(get_equipped_test_case(APITransactionTestCase)):
+    reset_sequences = True
+
+    def setUp(self):
+        super().setUp()
+        # Events are sent from the thread which committed them, as in-memory
+        # channel layer does not wake consumers from other threads
+        self.publisher_loop = ImmediateLoop()
+        for publisher in [room_publisher, lobby_publisher]:
+            patcher = mock.patch.object(
+                publisher, 'loop', self.publisher_loop)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.create_words(self.words)
+
+        for i in range(6):
+            self.create_user(username=f'user{i}')
+        self.communicators = []
+        self.snapshots = []
+
+    async def clear(self):
+
+        @database_sync_to_async
+        def clear_tables():
+            Room.objects.all().delete()
+            Match.objects.all().delete()
+            SelectedWord.objects.all().delete()
+
+        await clear_tables()
+        for communicator in self.communicators:
+            await communicator.disconnect()
+
+        self.communicators.clear()
+        self.snapshots.clear()
+
+    async def get_ticket(self, username, room_id=1):
+        response = await self.async_client.get(
+            reverse('get_ticket', args=[room_id]),
+            AUTHORIZATION=f'Token {self.users[username].auth_token}',
+        )
+
+        return response.data['ticket']
+
+    def get_room_websocket_application(self):
+        return TicketAuthMiddlewareStack(
+            URLRouter(
+                websocket_urlpatterns
+            )
+        )
+
+    async def connect(self, room_id: int, username: str, since=None):
+        ticket = await self.get_ticket(username, room_id)
+        path = f'rooms/{room_id}?ticket={ticket}'
+        if since is not None:
+            path += f'&since={since}'
+        communicator = WebsocketCommunicator(
+            self.get_room_websocket_application(),
+            path
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+
+        return communicator
+
+    async def get_communicator(self, room_id: int, username: str):
+        communicator = await self.connect(room_id, username)
+
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual('snapshot', snapshot['type'])
+
+        self.communicators.append(communicator)
+        self.snapshots.append(snapshot)
+
+        return communicator
+
+    @staticmethod
+    def apply_delta(snapshot, delta):
+        room = snapshot['data']
+        for key, value in delta['data'].items():
+            if key != 'match' or room['match'] is None:
+                room[key] = value
+                continue
+
+            for match_key, match_value in value.items():
+                if match_key != 'word':
+                    room['match'][match_key] = match_value
+                    continue
+
+                words = room['match']['words']
+                index = match_value['index']
+                words.extend([None] * (index + 1 - len(words)))
+                words[index] = {'text': match_value['text']}
+        snapshot['seq'] = delta['seq']
+
+    async def test_player_should_not_establish_socket_to_not_existing_room(
+        self
+    ):
+        communicator = WebsocketCommunicator(
+            self.get_room_websocket_application(),
+            'rooms/1'
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertFalse(connected)
+        await communicator.disconnect()
+
+        await self.clear()
+
+    async def test_player_should_not_establish_socket_without_ticket(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+
+        communicator = WebsocketCommunicator(
+            self.get_room_websocket_application(),
+            'rooms/1'
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertFalse(connected)
+        await communicator.disconnect()
+
+        await self.clear()
+
+    async def test_player_should_not_establish_socket_with_invalid_ticket(
+        self
+    ):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+
+        communicator = WebsocketCommunicator(
+            self.get_room_websocket_application(),
+            'rooms/1?ticket=invalidticketrandom'
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertFalse(connected)
+        await communicator.disconnect()
+
+        await self.clear()
+
+    @override_settings(TICKET_VALIDITY_PERIOD_SECONDS=2)
+    @async_to_sync
+    async def test_player_should_not_establish_socket_with_expired_ticket(
         self
     ):
         await sync_to_async(self.create_sample_room)(creator='user1')
@@ -958,6 +2490,9 @@ class PushNotificationTestCase(get_equipped_test_case(APITransactionTestCase)):
         self.assertEqual(1, len(set(list([
             json.dumps(x) for x in pushes
         ]))))
+        self.assertEqual('delta', pushes[0]['type'])
+        for snapshot in self.snapshots:
+            self.apply_delta(snapshot, pushes[0])
 
         return pushes[0]
 
@@ -991,6 +2526,13 @@ class PushNotificationTestCase(get_equipped_test_case(APITransactionTestCase)):
             match.total_round_count = total_round
             match.save()
 
+            # It is changed behind the views, so no delta is sent for it
+            for snapshot in self.snapshots:
+                snapshot['data']['match'].update({
+                    'round_duration_seconds': round_duration,
+                    'total_round_count': total_round,
+                })
+
         await modify_match()
 
         explaining_player = await sync_to_async(self.get_explaining_player)()
@@ -1002,7 +2544,7 @@ class PushNotificationTestCase(get_equipped_test_case(APITransactionTestCase)):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
 
         push = await self.gather_all_pushes()
-        self.assertEqual(1, len(push['data']['match']['words']))
+        self.assertEqual(0, push['data']['match']['word']['index'])
         self.assertEqual(Match.State.PLAYING, push['data']['match']['state'])
 
         response = await self.async_client.post(
@@ -1013,7 +2555,8 @@ class PushNotificationTestCase(get_equipped_test_case(APITransactionTestCase)):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
 
         push = await self.gather_all_pushes()
-        self.assertEqual(2, len(push['data']['match']['words']))
+        self.assertEqual(1, push['data']['match']['word']['index'])
+        self.assertNotIn('state', push['data']['match'])
 
         response = await self.async_client.post(
             reverse('correct', args=[1]),
@@ -1023,11 +2566,359 @@ class PushNotificationTestCase(get_equipped_test_case(APITransactionTestCase)):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
 
         push = await self.gather_all_pushes()
-        self.assertEqual(3, len(push['data']['match']['words']))
+        self.assertEqual(2, push['data']['match']['word']['index'])
+        self.assertEqual(response.data['word'],
+                         push['data']['match']['word']['text'])
 
         await asyncio.sleep(10)
 
         push = await self.gather_all_pushes()
         self.assertEqual(Match.State.WAITING, push['data']['match']['state'])
 
+        room = await sync_to_async(self.get_room)()
+        for snapshot in self.snapshots:
+            self.assertEqual(
+                json.loads(json.dumps(room.data)),
+                snapshot['data']
+            )
+
+        await self.clear()
+
+    async def test_deltas_are_applied_on_snapshot(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+        await sync_to_async(self.join_room)('user2')
+        await sync_to_async(self.join_room)('user3')
+
+        communicator = await self.get_communicator(1, 'user1')
+        self.assertEqual(3, self.snapshots[0]['seq'])
+        self.assertEqual(
+            ['user1', 'user2', 'user3'],
+            sorted(self.snapshots[0]['data']['players'])
+        )
+
+        await sync_to_async(self.join_room)('user4')
+        push = await communicator.receive_json_from()
+        self.assertEqual({'type': 'delta', 'seq': 4}, {
+            'type': push['type'],
+            'seq': push['seq'],
+        })
+        self.apply_delta(self.snapshots[0], push)
+
+        await sync_to_async(self.start_match)('user1')
+        push = await communicator.receive_json_from()
+        self.assertEqual(5, push['seq'])
+        self.apply_delta(self.snapshots[0], push)
+
+        room = await sync_to_async(self.get_room)()
+        self.assertEqual(
+            json.loads(json.dumps(room.data)),
+            self.snapshots[0]['data']
+        )
+
+        await self.clear()
+
+    async def test_reconnecting_client_gets_missed_deltas(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+        await sync_to_async(self.join_room)('user2')
+
+        communicator = await self.connect(1, 'user1', since=1)
+        push = await communicator.receive_json_from()
+        self.assertEqual('delta', push['type'])
+        self.assertEqual(2, push['seq'])
+        self.assertIn('user2', push['data']['players'])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+        communicator = await self.connect(1, 'user1', since=2)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+        await self.clear()
+
+    @override_settings(ROOM_EVENT_BUFFER_SIZE=2)
+    @async_to_sync
+    async def test_client_behind_ring_buffer_gets_snapshot(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+        await sync_to_async(self.join_room)('user2')
+        await sync_to_async(self.join_room)('user3')
+
+        self.assertEqual(2, await database_sync_to_async(
+            RoomEvent.objects.filter(room_id=1).count)())
+
+        for since in [0, 5]:
+            communicator = await self.connect(1, 'user1', since=since)
+            push = await communicator.receive_json_from()
+            self.assertEqual('snapshot', push['type'])
+            self.assertEqual(3, push['seq'])
+            await communicator.disconnect()
+
+        communicator = await self.connect(1, 'user1', since=1)
+        pushes = [
+            await communicator.receive_json_from(),
+            await communicator.receive_json_from(),
+        ]
+        self.assertEqual([2, 3], [push['seq'] for push in pushes])
+        self.assertEqual('delta', pushes[1]['type'])
+        await communicator.disconnect()
+
+        await self.clear()
+
+    @override_settings(LOBBY_TICK_SECONDS=0.5)
+    @async_to_sync
+    async def test_lobby_changes_are_batched_per_tick(self):
+        communicator = WebsocketCommunicator(
+            self.get_room_websocket_application(),
+            'lobby'
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+        await sync_to_async(self.join_room)('user2')
+        await sync_to_async(self.join_room)('user3')
+
+        # Lobby is flushed from scheduler thread, wait for the tick to pass
+        await asyncio.sleep(1)
+        push = await communicator.receive_json_from()
+        self.assertEqual('rooms', push['type'])
+        self.assertEqual(1, len(push['data']))
+        self.assertEqual(3, push['data'][0]['player_count'])
+        self.assertEqual([], push['removed'])
+        self.assertTrue(await communicator.receive_nothing())
+
+        await sync_to_async(self.join_room)('user4')
+        await sync_to_async(self.start_match)('user1')
+
+        await asyncio.sleep(1)
+        push = await communicator.receive_json_from()
+        self.assertEqual(4, push['data'][0]['player_count'])
+        self.assertEqual(Match.State.NEWBORN, push['data'][0]['state'])
+
+        await communicator.disconnect()
+        await self.clear()
+
+    async def test_room_events_are_coalesced(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+
+        communicator = await self.get_communicator(1, 'user1')
+
+        self.publisher_loop.paused = True
+        for username in ['user2', 'user3', 'user4']:
+            await sync_to_async(self.join_room)(username)
+        await sync_to_async(self.start_match)('user1')
+        await sync_to_async(self.publisher_loop.resume)()
+
+        push = await communicator.receive_json_from()
+        self.assertEqual('delta', push['type'])
+        self.assertEqual(5, push['seq'])
+        self.assertEqual(
+            ['user1', 'user2', 'user3', 'user4'],
+            push['data']['players']
+        )
+        self.assertEqual(Match.State.NEWBORN, push['data']['match']['state'])
+        self.assertTrue(await communicator.receive_nothing())
+
+        self.apply_delta(self.snapshots[0], push)
+        room = await sync_to_async(self.get_room)()
+        self.assertEqual(
+            json.loads(json.dumps(room.data)),
+            self.snapshots[0]['data']
+        )
+
+        await self.clear()
+
+    async def test_msgpack_subprotocol(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+
+        ticket = await self.get_ticket('user1')
+        communicator = WebsocketCommunicator(
+            self.get_room_websocket_application(),
+            f'rooms/1?ticket={ticket}',
+            subprotocols=['gerd.unknown', 'gerd.msgpack.v1']
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual('gerd.msgpack.v1', subprotocol)
+
+        snapshot = msgpack.unpackb(
+            await communicator.receive_from(), strict_map_key=False)
+        self.assertEqual('snapshot', snapshot[KEY_CODES['type']])
+        self.assertEqual(
+            ['user1'],
+            snapshot[KEY_CODES['data']][KEY_CODES['players']]
+        )
+
+        await sync_to_async(self.join_room)('user2')
+        delta = msgpack.unpackb(
+            await communicator.receive_from(), strict_map_key=False)
+        self.assertEqual({
+            KEY_CODES['type']: 'delta',
+            KEY_CODES['seq']: 2,
+            KEY_CODES['data']: {KEY_CODES['players']: ['user1', 'user2']},
+        }, delta)
+
+        await communicator.disconnect()
+        await self.clear()
+
+    @override_settings(ROOM_OUTBOX_SIZE=1)
+    @async_to_sync
+    async def test_slow_client_gets_latest_snapshot(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+        communicator = await self.get_communicator(1, 'user1')
+
+        send_frame = RoomConsumer.send_frame
+
+        # Daphne's send does not wait for slow sockets, a server which does
+        # is stood in for by slowing down sends
+        async def slow_send_frame(consumer, frame):
+            await asyncio.sleep(0.2)
+            await send_frame(consumer, frame)
+
+        coalesced = outbox_coalesced.value
+        with mock.patch.object(RoomConsumer, 'send_frame', slow_send_frame):
+            for username in ['user2', 'user3', 'user4']:
+                await sync_to_async(self.join_room)(username)
+
+            push = await communicator.receive_json_from()
+            self.assertEqual(
+                {'type': 'delta', 'seq': 2},
+                {'type': push['type'], 'seq': push['seq']}
+            )
+            push = await communicator.receive_json_from()
+            self.assertEqual(
+                {'type': 'snapshot', 'seq': 4},
+                {'type': push['type'], 'seq': push['seq']}
+            )
+            self.assertEqual(
+                ['user1', 'user2', 'user3', 'user4'],
+                push['data']['players']
+            )
+            self.assertTrue(await communicator.receive_nothing())
+        self.assertEqual(coalesced + 1, outbox_coalesced.value)
+
+        await self.clear()
+
+    async def test_late_event_is_taken_from_room_buffer(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+
+        communicator = await self.get_communicator(1, 'user1')
+
+        self.publisher_loop.paused = True
+        await sync_to_async(self.join_room)('user2')
+        await sync_to_async(self.join_room)('user3')
+        # Event 3 is published before event 2
+        channel_layer = get_channel_layer()
+        await channel_layer.group_send('room_1', {
+            'type': 'room_event',
+            'events': [encode_delta({
+                'first_seq': 3,
+                'seq': 3,
+                'data': {'players': ['user1', 'user2', 'user3']},
+            })],
+        })
+
+        push = await communicator.receive_json_from()
+        self.assertEqual({'type': 'delta', 'seq': 2}, {
+            'type': push['type'],
+            'seq': push['seq'],
+        })
+        self.assertEqual(['user1', 'user2'], push['data']['players'])
+
+        push = await communicator.receive_json_from()
+        self.assertEqual(3, push['seq'])
+        self.assertEqual(['user1', 'user2', 'user3'], push['data']['players'])
+
+        await sync_to_async(self.publisher_loop.resume)()
+        self.assertTrue(await communicator.receive_nothing())
+
+        await self.clear()
+
+    async def test_catch_up_is_not_older_than_received_events(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+
+        communicator = await self.get_communicator(1, 'user1')
+
+        self.publisher_loop.paused = True
+        await sync_to_async(self.join_room)('user2')
+        await sync_to_async(self.join_room)('user3')
+        # Version loaded by a reader before events 2 and 3 were committed
+        await sync_to_async(cache.set)(get_version_key(1), 1)
+        channel_layer = get_channel_layer()
+        await channel_layer.group_send('room_1', {
+            'type': 'room_event',
+            'events': [encode_delta({
+                'first_seq': 3,
+                'seq': 3,
+                'data': {'players': ['user1', 'user2', 'user3']},
+            })],
+        })
+
+        pushes = [
+            await communicator.receive_json_from(),
+            await communicator.receive_json_from(),
+        ]
+        self.assertEqual([2, 3], [push['seq'] for push in pushes])
+
+        await sync_to_async(self.publisher_loop.resume)()
+        self.assertTrue(await communicator.receive_nothing())
+
+        await self.clear()
+
+    async def test_websocket_is_closed_when_catch_up_fails(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+
+        communicator = await self.get_communicator(1, 'user1')
+
+        self.publisher_loop.paused = True
+        await sync_to_async(self.join_room)('user2')
+        with mock.patch('core.consumers.get_room_catch_up', side_effect=(
+            OperationalError('database is locked')
+        )), self.assertLogs('core.consumers', 'ERROR'):
+            await get_channel_layer().group_send('room_1', {
+                'type': 'room_event',
+                'events': [encode_delta({
+                    'first_seq': 3,
+                    'seq': 3,
+                    'data': {'players': ['user1', 'user2', 'user3']},
+                })],
+            })
+
+            self.assertEqual(
+                {'type': 'websocket.close', 'code': INTERNAL_ERROR_CLOSE_CODE},
+                await communicator.receive_output()
+            )
+
+        await sync_to_async(self.publisher_loop.resume)()
+        await self.clear()
+
+    async def test_stale_deltas_are_dropped(self):
+        await sync_to_async(self.create_sample_room)(creator='user1')
+        await sync_to_async(self.join_room)('user1')
+        await sync_to_async(self.join_room)('user2')
+
+        communicator = await self.get_communicator(1, 'user1')
+
+        channel_layer = get_channel_layer()
+        for seq in [1, 2, 3]:
+            await channel_layer.group_send('room_1', {
+                'type': 'room_event',
+                'events': [encode_delta(
+                    {'first_seq': seq, 'seq': seq, 'data': {'teams': seq}}
+                )],
+            })
+
+        push = await communicator.receive_json_from()
+        self.assertEqual(3, push['seq'])
+        self.assertTrue(await communicator.receive_nothing())
+
         await self.clear()
@@ -1,44 +1,254 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, FrozenSet, Optional, Tuple
 from urllib.parse import parse_qs
 
 import jwt
-from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
 
-from core.models import Room
+from core.metrics import registry
+from core.models import Seat
+
+# Close code of websockets which are not admitted, after a message telling
+# when to try again
+RETRY_LATER_CLOSE_CODE = 4503
+
+
+class MembershipCache:
+    """
+    Ids of players of recently connected rooms, kept in this process for
+    `MEMBERSHIP_CACHE_SECONDS`, and for at most `MEMBERSHIP_CACHE_SIZE`
+    rooms.
+
+    Players only join rooms, so a player missing from a cached room may
+    have just joined and the room is loaded again, and a cached player is
+    a player of the room.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # room id -> (expiry in monotonic time, player ids)
+        self._rooms: 'OrderedDict[int, Tuple[float, FrozenSet[int]]]' = \
+            OrderedDict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rooms.clear()
+
+    def get(self, room_id: int) -> Optional[FrozenSet[int]]:
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._rooms[room_id]
+                return None
+            self._rooms.move_to_end(room_id)
+            return entry[1]
+
+    def set(self, room_id: int, player_ids: FrozenSet[int]) -> None:
+        with self._lock:
+            self._rooms[room_id] = (
+                time.monotonic() + settings.MEMBERSHIP_CACHE_SECONDS,
+                player_ids
+            )
+            self._rooms.move_to_end(room_id)
+            while len(self._rooms) > settings.MEMBERSHIP_CACHE_SIZE:
+                self._rooms.popitem(last=False)
+
+    def invalidate(self, room_id: int) -> None:
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+
+memberships = MembershipCache()
 
 
 @database_sync_to_async
-def get_user_and_room(username, room_pk):
-    user = User.objects.get(username=username)
-    room = Room.objects.get(pk=room_pk)
-    if not room.players.filter(pk=user.id).exists():
-        raise Exception('Player has not joined to room')
-    return user, room
+def load_room_players(room_pk: int) -> FrozenSet[int]:
+    player_ids = frozenset(Seat.objects.filter(
+        room_id=room_pk).values_list('user_id', flat=True))
+    memberships.set(room_pk, player_ids)
+    return player_ids
+
+
+async def is_room_player(user_id: int, room_pk: int) -> bool:
+    player_ids = memberships.get(room_pk)
+    if player_ids is None or user_id not in player_ids:
+        player_ids = await load_room_players(room_pk)
+    return user_id in player_ids
+
+
+class HandshakeAdmission:
+    """
+    Let at most `HANDSHAKE_CONCURRENCY` websocket handshakes of this
+    process run at once, others wait in line for up to
+    `HANDSHAKE_QUEUE_SECONDS` and are turned away after that.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.accepted = registry.counter(
+            'websocket_handshakes_accepted_total',
+            'Websocket handshakes admitted at once or after waiting'
+        )
+        self.queued = registry.counter(
+            'websocket_handshakes_queued_total',
+            'Websocket handshakes which waited for admission'
+        )
+        self.rejected = registry.counter(
+            'websocket_handshakes_rejected_total',
+            'Websocket handshakes told to retry later'
+        )
+        self.in_progress = registry.gauge(
+            'websocket_handshakes_in_progress',
+            'Websocket handshakes being admitted or served'
+        )
+
+    async def acquire(self) -> bool:
+        if self.active < settings.HANDSHAKE_CONCURRENCY:
+            self._admit()
+            return True
+
+        self.queued.inc()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # `release` hands its slot over, so `active` is not changed
+            await asyncio.wait_for(
+                waiter, settings.HANDSHAKE_QUEUE_SECONDS)
+        except asyncio.TimeoutError:
+            self.rejected.inc()
+            return False
+        except asyncio.CancelledError:
+            # Slot may be handed over right before the client went away
+            if waiter.done() and not waiter.cancelled():
+                self.in_progress.inc()
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.accepted.inc()
+        self.in_progress.inc()
+        return True
+
+    def _admit(self) -> None:
+        self.active += 1
+        self.accepted.inc()
+        self.in_progress.inc()
+
+    def release(self) -> None:
+        self.in_progress.dec()
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+admission = HandshakeAdmission()
+
+
+def get_retry_after() -> float:
+    """
+    Return seconds to wait before reconnecting, spread over twice the
+    configured delay, so turned away clients do not come back together.
+    """
+    delay = settings.HANDSHAKE_RETRY_AFTER_SECONDS
+    return round(random.uniform(delay, 2 * delay), 3)
+
+
+async def retry_later(receive, send) -> None:
+    # Close codes are sent only after accepting the websocket
+    await receive()
+    await send({'type': 'websocket.accept'})
+    await send({
+        'type': 'websocket.send',
+        'text': json.dumps({
+            'type': 'retry',
+            'after': get_retry_after(),
+        }),
+    })
+    await send({'type': 'websocket.close', 'code': RETRY_LATER_CLOSE_CODE})
 
 
 class TicketAuthMiddleware:
+    """
+    Authenticate websockets by the ticket of `get_ticket` view, which
+    carries id and username of a player and the room they have joined.
+    The player is checked against `memberships`, so handshakes of known
+    rooms do not touch the database.
+
+    Handshakes pass `admission` first, which holds them until the
+    consumer has handled connecting, and those which are not admitted
+    in time get a `{'type': 'retry', 'after': seconds}` message and
+    are closed with `RETRY_LATER_CLOSE_CODE`.
+    """
+
     def __init__(self, app):
         # Store the ASGI application we were passed
         self.app = app
 
     async def __call__(self, scope, receive, send):
+        if not await admission.acquire():
+            await retry_later(receive, send)
+            return
+
+        released = False
+        received = 0
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                admission.release()
+
+        async def receive_after_connect():
+            # The consumer asks for the message after `websocket.connect`
+            # once it has handled it
+            nonlocal received
+            received += 1
+            if received > 1:
+                release()
+            return await receive()
+
+        try:
+            return await self.authenticate(
+                scope, receive_after_connect, send)
+        finally:
+            release()
+
+    async def authenticate(self, scope, receive, send):
+        scope['user'] = AnonymousUser()
         query_string = parse_qs(scope["query_string"].decode("utf-8"))
         if "ticket" in query_string:
             ticket = query_string["ticket"][0]
             try:
                 token = jwt.decode(ticket, settings.TICKET_SECRET,
                                    algorithms=["HS256"])
-                user, room = await get_user_and_room(
-                    token["username"], token["room"])
-                scope['user'] = user
-                scope['room_pk'] = room.pk
+                room_pk = int(token["room"])
+                if not await is_room_player(token["uid"], room_pk):
+                    raise Exception('Player has not joined to room')
+                scope['user'] = User(
+                    pk=token["uid"], username=token["username"])
+                scope['room_pk'] = room_pk
             except Exception:
                 scope['user'] = AnonymousUser()
         return await self.app(scope, receive, send)
 
 
-def TicketAuthMiddlewareStack(inner): return TicketAuthMiddleware(
-    AuthMiddlewareStack(inner)
-)
+def TicketAuthMiddlewareStack(inner):
+    """
+    Websockets are authenticated by tickets only, session authentication
+    would load the session and its user from database on every handshake.
+    """
+    return TicketAuthMiddleware(inner)
@@ -1,39 +1,126 @@
-import random
-import threading
-import time
 from datetime import datetime, timedelta
-from functools import cache
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-import channels.layers
 import jwt
-from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import generics, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import (APIException, PermissionDenied,
                                        ValidationError)
-from rest_framework.permissions import (IsAuthenticated,
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import (IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
-from core.models import Match, Room, SelectedWord, Word
-from core.serializers import RoomSerializer
+from core.lobby import lobby_publisher
+from core.metrics import registry
+from core.models import Match, Room, RoomEvent, Seat, SelectedWord
+from core.publisher import room_publisher
+from core.roomcache import (get_room_snapshot, get_room_version,
+                            invalidate_room_version)
+from core.scheduler import round_scheduler
+from core.serializers import (MatchSerializer, RoomSerializer,
+                              RoomSummarySerializer, serialize_match_fields)
+from core.ticket_auth import memberships
+from core.words import BankWord, draw_word, get_deck_values
 
 
 class RoomList(generics.ListCreateAPIView):
-    queryset = Room.objects.all()
+    queryset = Room.objects.with_details()
     serializer_class = RoomSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        lobby_publisher.room_changed(serializer.instance.pk)
+
 
 class RoomDetail(generics.RetrieveAPIView):
-    queryset = Room.objects.all()
+    """
+    Return room with `ETag` of its version, a request whose `If-None-Match`
+    has the current version is answered with 304 from cache.
+    """
+    queryset = Room.objects.with_details()
     serializer_class = RoomSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        try:
+            version = get_room_version(pk)
+            if quote_etag(str(version)) in parse_etags(
+                request.headers.get('If-None-Match', '')
+            ):
+                return Response(
+                    status=status.HTTP_304_NOT_MODIFIED,
+                    headers={'ETag': quote_etag(str(version))}
+                )
+
+            version, data = get_room_snapshot(pk, version)
+        except Room.DoesNotExist:
+            raise Http404
+
+        return Response(data, headers={'ETag': quote_etag(str(version))})
+
+
+class LobbyPagination(CursorPagination):
+    ordering = '-id'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+def is_true(value: Optional[str]) -> bool:
+    return value is not None and value.lower() in ['1', 'true', 'yes']
+
+
+def get_prefix_end(prefix: str) -> Optional[str]:
+    """
+    Smallest string, by code points, greater than all strings which start
+    with prefix, or `None` if there is none
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class Lobby(generics.ListAPIView):
+    """
+    List summary of rooms, newest first, one page at a time
+
+    Filters:
+    - `open_seats`: only rooms which players can still join
+    - `not_started`: only rooms whose match is not started
+    - `name_prefix`: only rooms whose names start with it, case-sensitive
+
+    Name prefix is looked up as a range of names rather than `LIKE`, which
+    can not use the index on names, as SQLite's is case-insensitive.
+    """
+    serializer_class = RoomSummarySerializer
+    pagination_class = LobbyPagination
+
+    def get_queryset(self):
+        queryset = Room.objects.select_related('match')
+        params = self.request.query_params
+
+        if is_true(params.get('open_seats')):
+            queryset = queryset.filter(player_count__lt=4)
+        if is_true(params.get('not_started')):
+            queryset = queryset.filter(match__isnull=True)
+        if params.get('name_prefix'):
+            queryset = queryset.filter(name__gte=params['name_prefix'])
+            prefix_end = get_prefix_end(params['name_prefix'])
+            if prefix_end is not None:
+                queryset = queryset.filter(name__lt=prefix_end)
+
+        return queryset
+
 
 class LogicError(APIException):
     status_code = 400
@@ -47,15 +134,42 @@ class WordSetupError(APIException):
     default_code = 'words_unavailable'
 
 
-def send_room_update(room: Room):
-    channel_layer = channels.layers.get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'room_{room.id}',
-        {
-            'type': 'room_event',
-            'data': RoomSerializer(room).data
-        }
-    )
+def record_room_event(room: Room, data: Dict[str, Any]) -> int:
+    """
+    Give the next sequence number of room, which is also its version, to
+    event and keep it in room's ring buffer to be replayed to reconnecting
+    websockets.
+    """
+    with transaction.atomic():
+        Room.objects.filter(pk=room.pk).update(event_seq=F('event_seq') + 1)
+        seq = Room.objects.values_list('event_seq', flat=True).get(pk=room.pk)
+        RoomEvent.objects.update_or_create(
+            room_id=room.pk,
+            slot=seq % settings.ROOM_EVENT_BUFFER_SIZE,
+            defaults={'seq': seq, 'data': data}
+        )
+    return seq
+
+
+def send_room_delta(room: Room, data: Dict[str, Any]) -> None:
+    """
+    Send only changed parts of room to its websockets, see `RoomConsumer`
+    for how they are applied to the snapshot sent on connect.
+
+    Nothing is sent until the running transaction is committed, and then
+    `room_publisher` sends it in the background.
+    """
+    room_id = room.pk
+    seq = record_room_event(room, data)
+
+    def publish():
+        invalidate_room_version(room_id)
+        room_publisher.room_changed(room_id, seq, data)
+        if 'players' in data or 'teams' in data or \
+                'state' in data.get('match', {}):
+            lobby_publisher.room_changed(room_id)
+
+    transaction.on_commit(publish)
 
 
 @api_view(['POST'])
@@ -65,15 +179,15 @@ def join_room(request, pk):
     Enter authenticated player to room
     """
     with transaction.atomic():
-        room = get_object_or_404(Room, pk=pk)
+        room = get_object_or_404(Room.objects.select_for_update(), pk=pk)
 
         if room.players.filter(pk=request.user.pk).exists():
             return Response(status=status.HTTP_200_OK)
 
         if room.players.count() < 4:
-            room.players.add(request.user)
-            room.save()
-            send_room_update(room)
+            room.seat_player(request.user)
+            send_room_delta(room, {'players': room.get_player_usernames()})
+            transaction.on_commit(lambda: memberships.invalidate(room.pk))
             return Response(status=status.HTTP_200_OK)
         else:
             raise LogicError(detail='Maximum room capacity exceeded')
@@ -103,38 +217,26 @@ def start_match(request, pk):
     )
 
     match.save()
-    send_room_update(room)
+    send_room_delta(room, {'match': MatchSerializer(match).data})
     return Response(status=status.HTTP_200_OK)
 
 
-@cache
-def get_words_all_indices(complexity: int) -> List[int]:
-    """
-    Following query result will be cached, so we should reload
-    our web app after each time we modified `Word` table.
-    """
-    return Word.objects.filter(complexity=complexity).values_list(
-        'id', flat=True).order_by('id')
+def get_next_word(match: Match) -> BankWord:
+    word = draw_word(match)
+    if word is None:
+        raise WordSetupError()
+    return word
 
 
-def get_random_word() -> Word:
-    complexity = random.choices(
-        [
-            Word.Complexity.EASY,
-            Word.Complexity.INTERMEDIATE,
-            Word.Complexity.HARD,
-        ],
-        weights=[
-            4,
-            2,
-            1
-        ],
-        k=1
+def select_word(match: Match, word: BankWord) -> Dict[str, Any]:
+    """
+    Add word to match's words and return it as it is sent in room deltas
+    """
+    SelectedWord.objects.create(
+        text_id=word.id,
+        match=match
     )
-    indices = get_words_all_indices(complexity[0])
-    if len(indices) == 0:
-        raise WordSetupError()
-    return Word.objects.get(pk=indices[random.randint(0, len(indices) - 1)])
+    return {'index': match.words.count() - 1, 'text': word.text}
 
 
 def get_room_and_check_turn(
@@ -142,13 +244,24 @@ def get_room_and_check_turn(
         pk,
         expected_states: List[Match.State]
 ):
-
-    room = get_object_or_404(Room, pk=pk)
-    players = room.players.values_list(
-        'username', flat=True).order_by('username')
-    if request.user.username not in players:
+    """
+    Fetch room, locked until the end of transaction, along with its match
+    and seat of the user in one indexed lookup, and check membership and
+    turn on them
+    """
+    seat = Seat.objects.select_related(
+        'room__match'
+    ).select_for_update(
+        of=('room',)
+    ).filter(
+        room_id=pk,
+        user_id=request.user.pk
+    ).first()
+    if seat is None:
+        get_object_or_404(Room, pk=pk)
         raise PermissionDenied(detail='You are not member of this room')
 
+    room = seat.room
     if not hasattr(room, 'match'):
         raise LogicError(detail='Room\'s match is not started yet')
 
@@ -157,7 +270,7 @@ def get_room_and_check_turn(
             detail=f'Match\'s state is not in {expected_states}'
         )
 
-    if players[room.match.current_turn] != request.user.username:
+    if seat.seat != room.match.current_turn:
         raise PermissionDenied(detail='This is not your turn')
 
     return room
@@ -173,23 +286,81 @@ def get_next_turn(room: Room) -> Optional[int]:
     return None
 
 
-def finish_round(on: datetime, room_id: int) -> None:
-    time.sleep((on - timezone.now()).seconds)
+def update_match(
+    match: Match,
+    expected_states: List[Match.State],
+    **values
+) -> None:
+    """
+    Write given values of match, in one conditional update, only if it is
+    still in one of expected states and in the same round, so concurrent
+    transitions are never overwritten. Values given as expressions are
+    read back from database.
+    """
+    updated = Match.objects.filter(
+        pk=match.pk,
+        state__in=expected_states,
+        current_round=match.current_round,
+    ).update(**values)
+    if not updated:
+        raise LogicError(detail='Match is changed meanwhile, try again')
+
+    expressions = [
+        name for name, value in values.items()
+        if hasattr(value, 'resolve_expression')
+    ]
+    if expressions:
+        match.refresh_from_db(fields=expressions)
+
+
+def finish_round(room_id: int, current_round: Optional[int] = None) -> None:
+    """
+    Finish playing round of room and move its match to the next one.
+
+    Scheduler gives the round the call is scheduled for, which is finished
+    whatever wall clock says, as its deadline is measured on monotonic
+    clock. Without it, e.g. by sweeper, only a round whose deadline is
+    passed is finished.
+    """
     try:
-        room = Room.objects.get(pk=room_id)
+        room = Room.objects.select_related('match').get(pk=room_id)
 
         if not hasattr(room, 'match'):
             return
 
+        if room.match.state != Match.State.PLAYING:
+            return
+        if current_round is not None:
+            if room.match.current_round != current_round:
+                return
+        elif room.match.round_deadline is not None and \
+                room.match.round_deadline > timezone.now():
+            return
+
         if room.match.current_round == room.match.total_round_count:
-            room.match.state = Match.State.FINISHED
+            values = {'state': Match.State.FINISHED}
         else:
-            room.match.current_turn = get_next_turn(room)
-            room.match.current_round += 1
-            room.match.state = Match.State.WAITING
+            values = {
+                'state': Match.State.WAITING,
+                'current_turn': get_next_turn(room),
+                'current_round': room.match.current_round + 1,
+            }
+
+        # Raises if round is already finished by someone else
+        update_match(
+            room.match,
+            [Match.State.PLAYING],
+            round_deadline=None,
+            **values
+        )
+        for name, value in values.items():
+            setattr(room.match, name, value)
+        room.match.round_deadline = None
 
-        room.match.save()
-        send_room_update(room)
+        send_room_delta(room, {
+            'match': serialize_match_fields(
+                room.match, ['state', 'current_turn', 'current_round'])
+        })
 
     except Exception:
         pass
@@ -197,8 +368,40 @@ def finish_round(on: datetime, room_id: int) -> None:
         close_old_connections()
 
 
+def sweep_overdue_rounds() -> None:
+    """
+    Finish rounds whose deadline is passed but are still playing, e.g.
+    because the process which scheduled them is restarted, then sweep
+    again after `ROUND_SWEEP_INTERVAL_SECONDS`.
+    """
+    try:
+        for room_id in Match.objects.filter(
+            state=Match.State.PLAYING,
+            round_deadline__lte=timezone.now(),
+        ).values_list('room_id', flat=True):
+            finish_round(room_id)
+    finally:
+        close_old_connections()
+        round_scheduler.schedule(
+            timezone.now() + timedelta(
+                seconds=settings.ROUND_SWEEP_INTERVAL_SECONDS
+            ),
+            sweep_overdue_rounds,
+            key='sweep_overdue_rounds'
+        )
+
+
+def start_round_sweeper() -> None:
+    round_scheduler.schedule(
+        timezone.now(),
+        sweep_overdue_rounds,
+        key='sweep_overdue_rounds'
+    )
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@transaction.atomic
 def play(request, pk):
     """
     Play match and return first word
@@ -213,27 +416,38 @@ def play(request, pk):
         Match.State.WAITING,
     ])
 
-    word = get_random_word()
-    SelectedWord.objects.create(
-        text=word,
-        match=room.match
-    )
+    word = get_next_word(room.match)
+    selected_word = select_word(room.match, word)
 
     room.match.state = Match.State.PLAYING
     room.match.round_start_time = timezone.now()
-    room.match.save()
+    room.match.round_deadline = room.match.round_start_time + timedelta(
+        seconds=room.match.round_duration_seconds
+    )
+    update_match(
+        room.match,
+        [Match.State.NEWBORN, Match.State.WAITING],
+        **get_deck_values(room.match),
+        state=room.match.state,
+        round_start_time=room.match.round_start_time,
+        round_deadline=room.match.round_deadline,
+    )
 
-    send_room_update(room)
+    send_room_delta(room, {
+        'match': {
+            **serialize_match_fields(
+                room.match, ['state', 'round_start_time']),
+            'word': selected_word,
+        }
+    })
 
-    threading.Thread(
-        target=finish_round,
-        args=(
-            room.match.round_start_time + timedelta(
-                seconds=room.match.round_duration_seconds
-            ),
-            pk
-        )
-    ).start()
+    round_scheduler.schedule(
+        room.match.round_deadline,
+        finish_round,
+        pk,
+        room.match.current_round,
+        key=('finish_round', pk)
+    )
 
     return Response(
         status=status.HTTP_200_OK,
@@ -241,7 +455,11 @@ def play(request, pk):
     )
 
 
-def add_score_to_team(room: Room, score: int, save: bool = True) -> None:
+def get_score_increment(room: Room, score: int) -> Dict[str, Any]:
+    """
+    Increment of explaining player's team score, to be applied by database
+    so concurrent increments are not lost
+    """
     team = None
     if room.teams == Room.Teams.ONE_TWO__THREE_FOUR:
         team = 0 if room.match.current_turn in [0, 1] else 1
@@ -251,19 +469,15 @@ def add_score_to_team(room: Room, score: int, save: bool = True) -> None:
         team = 0 if room.match.current_turn in [0, 3] else 1
 
     if team is None:
-        return
-
-    if team == 0:
-        room.match.team_one_score += score
-    else:
-        room.match.team_two_score += score
+        return {}
 
-    if save:
-        room.match.save()
+    field = 'team_one_score' if team == 0 else 'team_two_score'
+    return {field: F(field) + score}
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@transaction.atomic
 def correct(request, pk):
     """
     Add correct guess score to explaining player's team and get next word
@@ -277,15 +491,23 @@ def correct(request, pk):
         Match.State.PLAYING,
     ])
 
-    word = get_random_word()
-    SelectedWord.objects.create(
-        text=word,
-        match=room.match
-    )
+    word = get_next_word(room.match)
+    selected_word = select_word(room.match, word)
 
-    add_score_to_team(room, room.match.correct_guess_score)
+    update_match(
+        room.match,
+        [Match.State.PLAYING],
+        **get_deck_values(room.match),
+        **get_score_increment(room, room.match.correct_guess_score),
+    )
 
-    send_room_update(room)
+    send_room_delta(room, {
+        'match': {
+            **serialize_match_fields(
+                room.match, ['team_one_score', 'team_two_score']),
+            'word': selected_word,
+        }
+    })
 
     return Response(
         status=status.HTTP_200_OK,
@@ -295,6 +517,7 @@ def correct(request, pk):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@transaction.atomic
 def skip(request, pk):
     """
     Skip current guessing word and decrease playing team score by skip penalty
@@ -308,15 +531,23 @@ def skip(request, pk):
         Match.State.PLAYING,
     ])
 
-    word = get_random_word()
-    SelectedWord.objects.create(
-        text=word,
-        match=room.match
-    )
+    word = get_next_word(room.match)
+    selected_word = select_word(room.match, word)
 
-    add_score_to_team(room, room.match.skip_penalty * -1)
+    update_match(
+        room.match,
+        [Match.State.PLAYING],
+        **get_deck_values(room.match),
+        **get_score_increment(room, room.match.skip_penalty * -1),
+    )
 
-    send_room_update(room)
+    send_room_delta(room, {
+        'match': {
+            **serialize_match_fields(
+                room.match, ['team_one_score', 'team_two_score']),
+            'word': selected_word,
+        }
+    })
 
     return Response(
         status=status.HTTP_200_OK,
@@ -351,9 +582,9 @@ def rearrange(request, pk):
         })
 
     room.teams = teams
-    room.save()
+    room.save(update_fields=['teams'])
 
-    send_room_update(room)
+    send_room_delta(room, {'teams': room.teams})
     return Response(status=status.HTTP_200_OK)
 
 
@@ -370,6 +601,7 @@ def get_ticket(request, pk):
             'ticket': jwt.encode(
                 payload={
                     'room': pk,
+                    'uid': request.user.pk,
                     'username': request.user.username,
                     'exp': datetime.now(tz=timezone.utc) + timedelta(
                         seconds=settings.TICKET_VALIDITY_PERIOD_SECONDS
@@ -380,3 +612,12 @@ def get_ticket(request, pk):
             )
         }
     )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4'
+    )
@@ -0,0 +1,247 @@
+import hashlib
+import unicodedata
+from array import array
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from core.models import Word
+
+Rows = List[Tuple[str, int]]
+
+
+class WordImportError(Exception):
+    pass
+
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize('NFC', text.strip())
+
+
+def text_key(text: str) -> int:
+    """
+    64 bits hash of a normalized text, words are identified by their texts
+    and keeping hashes instead of texts keeps merging large files cheap.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little')
+
+
+def validate_rows(chunk: pd.DataFrame) -> Rows:
+    texts = chunk['text'].map(normalize_text)
+    complexities = pd.to_numeric(chunk['complexity'], errors='coerce')
+    text_lengths = texts.str.len()
+    invalid = ~complexities.isin(Word.Complexity.values) | (
+        text_lengths == 0) | (
+        text_lengths > Word._meta.get_field('text').max_length)
+    if invalid.any():
+        raise WordImportError(
+            f'Can create new word from given row, '
+            f'row:\n{chunk[invalid].iloc[0]}'
+        )
+
+    return list(zip(texts, complexities.astype(int)))
+
+
+def read_rows(csv_file: str, chunk_size: int) -> Iterator[Rows]:
+    """
+    Read `(text, complexity)` rows of CSV file in chunks of `chunk_size`.
+    """
+    try:
+        columns = pd.read_csv(csv_file, nrows=0).columns
+        for column in ['complexity', 'text']:
+            if column not in columns:
+                raise WordImportError(
+                    f'Can not find `{column}` in columns: {list(columns)}'
+                )
+
+        for chunk in pd.read_csv(
+            csv_file,
+            usecols=['text', 'complexity'],
+            dtype=str,
+            keep_default_na=False,
+            chunksize=chunk_size,
+        ):
+            yield validate_rows(chunk)
+    except (OSError, ValueError) as e:
+        raise WordImportError(f'Can not parse CSV file: {e}')
+
+
+def replace_words(
+    chunks: Iterable[Rows],
+    chunk_size: int,
+    on_chunk: Optional[Callable[[Dict[str, int]], None]] = None
+) -> Dict[str, int]:
+    """
+    Delete all existing words, along with matches history, and insert
+    words of given rows.
+    """
+    Word.objects.all().delete()
+
+    counts = {'read': 0, 'inserted': 0}
+    for rows in chunks:
+        Word.objects.bulk_create(
+            [
+                Word(text=text, complexity=complexity)
+                for text, complexity in rows
+            ],
+            batch_size=chunk_size
+        )
+        counts['read'] += len(rows)
+        counts['inserted'] += len(rows)
+        if on_chunk is not None:
+            on_chunk(counts)
+
+    return counts
+
+
+class KeySet:
+    """
+    Set of text keys kept in a few sorted arrays, whose sizes at least
+    halve from one to the next, so a key costs 8 bytes and adding keys
+    costs amortized O(log n) each, as merging arrays of an LSM tree.
+    """
+
+    def __init__(self):
+        self.levels: List[np.ndarray] = []
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(keys), dtype=bool)
+        for level in self.levels:
+            positions = np.minimum(
+                np.searchsorted(level, keys), len(level) - 1)
+            found |= level[positions] == keys
+        return found
+
+    def add(self, keys: np.ndarray) -> None:
+        if not len(keys):
+            return
+        level = np.unique(keys)
+        while self.levels and len(self.levels[-1]) <= 2 * len(level):
+            level = np.union1d(self.levels.pop(), level)
+        self.levels.append(level)
+
+
+def get_text_keys(texts: Iterable[str], count: int) -> np.ndarray:
+    return np.fromiter(
+        (text_key(text) for text in texts), dtype=np.uint64, count=count)
+
+
+def merge_words(
+    chunks: Iterable[Rows],
+    chunk_size: int,
+    on_chunk: Optional[Callable[[Dict[str, int]], None]] = None
+) -> Dict[str, int]:
+    """
+    Write only the difference between words table and given rows: insert
+    new words, update changed complexities, bring back retired words which
+    are in the rows again and retire words missing from them.
+
+    Existing words are kept as sorted arrays of their text keys, ids,
+    complexities and retired flags, and texts of rows as a `KeySet`, so
+    merging costs a few tens of bytes per word instead of Python objects.
+    """
+    keys = array('Q')
+    ids = array('q')
+    complexities = array('b')
+    retired = array('b')
+    for pk, text, complexity, is_retired in Word.objects.order_by(
+        'id'
+    ).values_list('id', 'text', 'complexity', 'retired').iterator(
+        chunk_size=chunk_size
+    ):
+        keys.append(text_key(normalize_text(text)))
+        ids.append(pk)
+        complexities.append(complexity)
+        retired.append(is_retired)
+
+    existing_keys = np.frombuffer(keys, dtype=np.uint64)
+    # Stable, so the first of words with the same text is the oldest one
+    order = np.argsort(existing_keys, kind='stable')
+    existing_keys = existing_keys[order]
+    existing_ids = np.frombuffer(ids, dtype=np.int64)[order]
+    existing_complexities = np.frombuffer(complexities, dtype=np.int8)[order]
+    existing_retired = np.frombuffer(retired, dtype=np.int8)[order] != 0
+    del keys, ids, complexities, retired, order
+
+    # Later words with the same text as an older one are retired
+    first = np.ones(len(existing_keys), dtype=bool)
+    first[1:] = existing_keys[1:] != existing_keys[:-1]
+    duplicates = existing_ids[~first & ~existing_retired]
+    existing_keys = existing_keys[first]
+    existing_ids = existing_ids[first]
+    existing_complexities = existing_complexities[first]
+    existing_retired = existing_retired[first]
+    seen = np.zeros(len(existing_keys), dtype=bool)
+    seen_new = KeySet()
+
+    counts = {
+        'read': 0,
+        'inserted': 0,
+        'updated': 0,
+        'retired': 0,
+        'unchanged': 0,
+    }
+    for rows in chunks:
+        row_keys = get_text_keys((text for text, _ in rows), len(rows))
+        # First rows of texts which are repeated in chunk
+        _, indices = np.unique(row_keys, return_index=True)
+        indices.sort()
+        row_keys = row_keys[indices]
+
+        positions = np.searchsorted(existing_keys, row_keys)
+        found = np.zeros(len(row_keys), dtype=bool)
+        inside = positions < len(existing_keys)
+        found[inside] = existing_keys[positions[inside]] == row_keys[inside]
+        new = ~found & ~seen_new.contains(row_keys)
+        # Texts which are already merged from an earlier chunk
+        found[found] = ~seen[positions[found]]
+        seen_new.add(row_keys[new])
+
+        new_words = [
+            Word(text=rows[index][0], complexity=rows[index][1])
+            for index in indices[new]
+        ]
+        # complexity -> ids of words which should get it
+        changed_ids: Dict[int, List[int]] = defaultdict(list)
+        for index, position in zip(indices[found], positions[found]):
+            seen[position] = True
+            complexity = rows[index][1]
+            if existing_complexities[position] == complexity and \
+                    not existing_retired[position]:
+                counts['unchanged'] += 1
+                continue
+            changed_ids[complexity].append(int(existing_ids[position]))
+
+        Word.objects.bulk_create(new_words, batch_size=chunk_size)
+        for complexity, changed in changed_ids.items():
+            Word.objects.filter(pk__in=changed).update(
+                complexity=complexity, retired=False)
+            counts['updated'] += len(changed)
+        counts['inserted'] += len(new_words)
+        counts['read'] += len(rows)
+        if on_chunk is not None:
+            on_chunk(counts)
+
+    retired_ids = np.concatenate([
+        duplicates,
+        existing_ids[~seen & ~existing_retired],
+    ])
+    for i in range(0, len(retired_ids), chunk_size):
+        Word.objects.filter(
+            pk__in=retired_ids[i:i + chunk_size].tolist()
+        ).update(retired=True)
+    counts['retired'] = len(retired_ids)
+    if on_chunk is not None:
+        on_chunk(counts)
+
+    return counts
+
+
+def words_changed(counts: Dict[str, int]) -> bool:
+    return any(
+        counts.get(name, 0) > 0
+        for name in ['inserted', 'updated', 'retired']
+    )
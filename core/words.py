@@ -0,0 +1,348 @@
+import logging
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from core.models import Match, Word, WordBankVersion
+
+COMPLEXITY_WEIGHTS: Dict[int, int] = {
+    Word.Complexity.EASY: 4,
+    Word.Complexity.INTERMEDIATE: 2,
+    Word.Complexity.HARD: 1,
+}
+
+DECK_CURSOR_FIELDS: Dict[int, str] = {
+    Word.Complexity.EASY: 'easy_words_drawn',
+    Word.Complexity.INTERMEDIATE: 'intermediate_words_drawn',
+    Word.Complexity.HARD: 'hard_words_drawn',
+}
+
+# Fields of match which are changed by drawing words
+DECK_FIELDS = [
+    'deck_seed',
+    'word_bank_version',
+    *DECK_CURSOR_FIELDS.values(),
+]
+
+_MASK_64 = (1 << 64) - 1
+
+logger = logging.getLogger(__name__)
+
+
+def _mix(value: int) -> int:
+    """
+    SplitMix64 finalizer, a cheap and well distributed integer hash.
+    """
+    value = (value + 0x9E3779B97F4A7C15) & _MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return value ^ (value >> 31)
+
+
+def shuffled_position(index: int, size: int, seed: int) -> int:
+    """
+    Return the card at `index` of a deck of `size` cards shuffled by `seed`.
+
+    The shuffle is a keyed permutation (a small Feistel network with cycle
+    walking), so any card can be computed in O(1) without materializing
+    the deck, and different indices never map to the same card.
+    """
+    half_bits = max((size - 1).bit_length() + 1, 2) // 2
+    half_mask = (1 << half_bits) - 1
+
+    position = index
+    while True:
+        left, right = position >> half_bits, position & half_mask
+        for round_number in range(4):
+            left, right = right, left ^ (
+                _mix(seed ^ (round_number << 60) ^ right) & half_mask
+            )
+        position = (left << half_bits) | right
+        if position < size:
+            return position
+
+
+class BankWord(NamedTuple):
+    id: int
+    text: str
+    complexity: int
+
+
+class WordBank:
+    """
+    Read-only in-memory copy of `Word` table.
+
+    Ids are kept sorted in a typed array, all texts are packed into a
+    single string addressed by an offsets array and each complexity
+    bucket is an array of positions into them, so a bank of millions of
+    words costs a few bytes per word plus its text.
+    """
+
+    def __init__(
+        self,
+        rows: Iterable[Tuple[int, str, int, bool]],
+        version: int = 0
+    ):
+        """
+        `rows` should be `(id, text, complexity, retired)` tuples ordered
+        by id, retired words are kept only to look up their texts.
+        """
+        self.version = version
+        self.ids = array('q')
+        self.complexities = array('b')
+        self.offsets = array('q', [0])
+        self.buckets: Dict[int, array] = {
+            complexity: array('l') for complexity in COMPLEXITY_WEIGHTS
+        }
+
+        texts = []
+        length = 0
+        for position, (pk, text, complexity, retired) in enumerate(rows):
+            self.ids.append(pk)
+            self.complexities.append(complexity)
+            texts.append(text)
+            length += len(text)
+            self.offsets.append(length)
+            if not retired:
+                self.buckets[complexity].append(position)
+
+        self.texts = ''.join(texts)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def word_at(self, position: int) -> BankWord:
+        return BankWord(
+            id=self.ids[position],
+            text=self.texts[
+                self.offsets[position]:self.offsets[position + 1]
+            ],
+            complexity=self.complexities[position],
+        )
+
+    def get(self, pk: int) -> Optional[BankWord]:
+        position = bisect_left(self.ids, pk)
+        if position == len(self.ids) or self.ids[position] != pk:
+            return None
+        return self.word_at(position)
+
+    def deck_word(self, complexity: int, index: int, seed: int) -> BankWord:
+        """
+        Return the `index`-th word of complexity bucket shuffled by `seed`.
+        """
+        bucket = self.buckets[complexity]
+        return self.word_at(bucket[shuffled_position(
+            index, len(bucket), _mix(seed ^ complexity))])
+
+
+def load_word_bank(version: int) -> WordBank:
+    return WordBank(
+        Word.objects.order_by('id').values_list(
+            'id', 'text', 'complexity', 'retired').iterator(),
+        version=version
+    )
+
+
+def get_published_version() -> int:
+    version = WordBankVersion.objects.order_by('-id').values_list(
+        'id', flat=True).first()
+    return 0 if version is None else version
+
+
+def publish_word_bank() -> int:
+    """
+    Announce that `Word` table is modified, every process will load the
+    new word bank on its next version check.
+    """
+    return WordBankVersion.objects.create().pk
+
+
+class WordBankRegistry:
+    """
+    Keep current word bank of this process along with a few recently
+    replaced ones, so matches can keep drawing from the version they
+    started with.
+
+    Published version is checked at most once per
+    `WORD_BANK_VERSION_CHECK_INTERVAL_SECONDS`. A new version is loaded by
+    a background thread, as loading a large `Word` table takes seconds,
+    and the previous bank is served until it is swapped in. Only a process
+    which has no bank yet loads one while drawing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._banks: 'OrderedDict[int, WordBank]' = OrderedDict()
+        self._current: Optional[WordBank] = None
+        self._checked_at = float('-inf')
+        # version being loaded in background
+        self._loading: Optional[int] = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._banks.clear()
+            self._current = None
+            self._checked_at = float('-inf')
+            self._loading = None
+
+    def current(self) -> WordBank:
+        current = self._current
+        if current is not None and time.monotonic() - self._checked_at < \
+                settings.WORD_BANK_VERSION_CHECK_INTERVAL_SECONDS:
+            return current
+
+        if not self._lock.acquire(blocking=current is None):
+            return current
+        try:
+            if current is None and self._current is not None:
+                return self._current
+
+            version = get_published_version()
+            self._checked_at = time.monotonic()
+            if self._current is None:
+                self._install(load_word_bank(version))
+                return self._current
+            if self._current.version == version or \
+                    self._loading is not None:
+                return self._current
+            self._loading = version
+        finally:
+            self._lock.release()
+
+        self.load_in_background(version)
+        return self._current
+
+    def load_in_background(self, version: int) -> None:
+        threading.Thread(
+            target=self.load,
+            args=(version,),
+            name='word_bank_loader',
+            daemon=True
+        ).start()
+
+    def load(self, version: int) -> None:
+        """
+        Load bank of version and make it current, unless it is installed
+        meanwhile.
+        """
+        try:
+            bank = load_word_bank(version)
+        except Exception:
+            bank = None
+            logger.exception('Can not load word bank %d', version)
+        finally:
+            close_old_connections()
+
+        with self._lock:
+            self._loading = None
+            if bank is not None and (
+                self._current is None or self._current.version != version
+            ):
+                self._install(bank)
+
+    def retained(self, version: int) -> Optional[WordBank]:
+        return self._banks.get(version)
+
+    def banks(self) -> List[WordBank]:
+        return list(reversed(self._banks.values()))
+
+    def _install(self, bank: WordBank) -> None:
+        banks = self._banks.copy()
+        banks[bank.version] = bank
+        while len(banks) > settings.WORD_BANK_RETAINED_VERSIONS:
+            banks.popitem(last=False)
+        self._banks = banks
+        self._current = bank
+
+
+word_banks = WordBankRegistry()
+
+
+def get_word_bank() -> WordBank:
+    return word_banks.current()
+
+
+def draw_word(match: Match) -> Optional[BankWord]:
+    """
+    Draw next word of match's deck and advance its cursor, caller is
+    responsible for saving `DECK_FIELDS` of the match.
+
+    A match is pinned to the word bank version it started with as long as
+    this process retains it, otherwise it moves to current version with a
+    new deck. Words are never repeated within a deck, and when whole deck
+    is drawn it is reshuffled.
+    """
+    bank = get_word_bank()
+    if match.word_bank_version is not None and \
+            match.word_bank_version != bank.version:
+        bank = word_banks.retained(match.word_bank_version) or bank
+
+    if not any(bank.buckets.values()):
+        return None
+
+    if match.word_bank_version != bank.version:
+        match.word_bank_version = bank.version
+        match.deck_seed = None
+
+    complexities = [
+        complexity for complexity in COMPLEXITY_WEIGHTS
+        if getattr(match, DECK_CURSOR_FIELDS[complexity])
+        < len(bank.buckets[complexity])
+    ]
+    if match.deck_seed is None or len(complexities) == 0:
+        match.deck_seed = random.getrandbits(63)
+        for field in DECK_CURSOR_FIELDS.values():
+            setattr(match, field, 0)
+        complexities = [
+            complexity for complexity in COMPLEXITY_WEIGHTS
+            if len(bank.buckets[complexity]) > 0
+        ]
+
+    complexity = random.choices(
+        complexities,
+        weights=[COMPLEXITY_WEIGHTS[c] for c in complexities],
+        k=1
+    )[0]
+    field = DECK_CURSOR_FIELDS[complexity]
+    index = getattr(match, field)
+    setattr(match, field, index + 1)
+    return bank.deck_word(complexity, index, match.deck_seed)
+
+
+def get_deck_values(match: Match) -> Dict[str, Any]:
+    return {field: getattr(match, field) for field in DECK_FIELDS}
+
+
+def get_word_texts(pks: Iterable[int]) -> Dict[int, str]:
+    """
+    Look up texts of words in retained word banks and fetch the missing
+    ones, e.g. words of a version which is not retained anymore, in one
+    query.
+    """
+    banks = word_banks.banks()
+    texts = dict()
+    missing = []
+    for pk in pks:
+        for bank in banks:
+            word = bank.get(pk)
+            if word is not None:
+                texts[pk] = word.text
+                break
+        else:
+            missing.append(pk)
+
+    if missing:
+        texts.update(
+            Word.objects.filter(pk__in=missing).values_list('id', 'text'))
+    return texts
+
+
+def get_word_text(pk: int) -> str:
+    return get_word_texts([pk])[pk]
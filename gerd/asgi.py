@@ -19,6 +19,9 @@ from django.core.asgi import get_asgi_application
 
 import core.routing
 from core.ticket_auth import TicketAuthMiddlewareStack
+from core.views import start_round_sweeper
+
+start_round_sweeper()
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
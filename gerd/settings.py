@@ -78,7 +78,8 @@ if 'test' in sys.argv:
 else:
     CHANNEL_LAYERS = {
         'default': {
-            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            # Redis channel layer which delivers to local members directly
+            'BACKEND': 'core.layers.LocalFirstChannelLayer',
             'CONFIG': {
                 "hosts": [(env('REDIS_HOST'), env('REDIS_PORT'))],
             },
@@ -130,6 +131,25 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+if 'test' in sys.argv:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            # Shared between processes, so a room version invalidated by one
+            # is not served by others
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f"redis://{env('REDIS_HOST')}:{env('REDIS_PORT')}/1",
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -182,3 +202,43 @@ REST_FRAMEWORK = {
 
 TICKET_SECRET = env('TICKET_SECRET')
 TICKET_VALIDITY_PERIOD_SECONDS = 60
+
+# Players of rooms are kept in each process for websocket handshakes
+MEMBERSHIP_CACHE_SECONDS = 60
+MEMBERSHIP_CACHE_SIZE = 10000
+
+# Websocket handshakes run at once in each process, others wait up to the
+# queue deadline and then are told to retry after a jittered delay
+HANDSHAKE_CONCURRENCY = 64
+HANDSHAKE_QUEUE_SECONDS = 2
+HANDSHAKE_RETRY_AFTER_SECONDS = 5
+
+# Number of recent events kept per room to be replayed to reconnecting
+# websockets, older clients get a fresh snapshot instead
+ROOM_EVENT_BUFFER_SIZE = 64
+
+# How long room snapshots are kept in cache
+ROOM_SNAPSHOT_CACHE_SECONDS = 60 * 60
+
+# How long room versions loaded from database are kept in cache, versions
+# are invalidated on change, this bounds a stale one loaded meanwhile
+ROOM_VERSION_CACHE_SECONDS = 10
+
+# Events of a room committed within this delay are sent as one broadcast
+ROOM_PUBLISH_DELAY_SECONDS = 0.005
+
+# Deltas waiting in a room consumer to be sent, beyond which they are
+# replaced by a snapshot, it does not bound what the server buffers
+ROOM_OUTBOX_SIZE = 32
+
+# Changes of rooms are sent to lobby websockets at most once per tick
+LOBBY_TICK_SECONDS = 1
+
+WORD_BANK_VERSION_CHECK_INTERVAL_SECONDS = 1
+WORD_BANK_RETAINED_VERSIONS = 2
+
+ROUND_SWEEP_INTERVAL_SECONDS = 30
+
+WORDS_FILE_CHUNK_SIZE = 10000
+WORDS_FILE_POLL_INTERVAL_SECONDS = 2
+WORDS_FILE_JOB_TIMEOUT_SECONDS = 600
@@ -18,14 +18,15 @@ from django.urls import path
 from rest_framework.authtoken import views
 from rest_framework.documentation import include_docs_urls
 
-from core.views import (RoomDetail, RoomList, correct, get_ticket, join_room,
-                        play, rearrange, skip, start_match)
+from core.views import (Lobby, RoomDetail, RoomList, correct, get_ticket,
+                        join_room, metrics, play, rearrange, skip, start_match)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('docs/', include_docs_urls(title='Gerd API')),
     path('api-token-auth/', views.obtain_auth_token),
     path('rooms/', RoomList.as_view(), name='rooms'),
+    path('lobby/', Lobby.as_view(), name='lobby'),
     path('rooms/<int:pk>/', RoomDetail.as_view(), name='room-detail'),
     path('rooms/<int:pk>/join', join_room, name='join-room'),
     path('rooms/<int:pk>/start', start_match, name='start-room-match'),
@@ -34,4 +35,5 @@ urlpatterns = [
     path('rooms/<int:pk>/skip', skip, name='skip'),
     path('rooms/<int:pk>/rearrange', rearrange, name='rearrange'),
     path('rooms/<int:pk>/ticket', get_ticket, name='get_ticket'),
+    path('metrics/', metrics, name='metrics'),
 ]